@@ -0,0 +1,288 @@
+"""
+Çevrimdışı benchmark - gerçek telefon ve QR taraması olmadan
+
+WhatsApp Web DOM taklidini (whatsapp_mock.html) yerel bir sunucudan headless Chrome'a verir,
+bot'u bu sayfaya bağlar, /otp'ye eşzamanlı POST atar ve sahte gelen mesajlarla
+OTP talebinden cevabın teslimine kadar geçen süreyi ölçer.
+
+Kullanım:
+    python bench/bench.py --otps 2000 --concurrency 16 --requests 100 --rate 5 --output bench_output.txt
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MOCK_PAGE_PATH = os.path.join(BENCH_DIR, "whatsapp_mock.html")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="WhatsApp OTP bot çevrimdışı benchmark")
+    parser.add_argument("--otps", type=int, default=2000, help="/otp'ye gönderilecek kayıt sayısı")
+    parser.add_argument("--concurrency", type=int, default=16, help="Eşzamanlı /otp istemcisi")
+    parser.add_argument("--requests", type=int, default=100, help="Uçtan uca ölçülecek OTP talebi sayısı")
+    parser.add_argument("--rate", type=float, default=5.0, help="Saniyede sahte gelen mesaj")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Son talepten sonra teslim için bekleme (sn)")
+    parser.add_argument("--ack-ms", type=int, default=30, help="Sahte sunucu onayı (tik) gecikmesi (ms)")
+    parser.add_argument("--mock-port", type=int, default=8765)
+    parser.add_argument("--http-port", type=int, default=5055)
+    parser.add_argument("--headful", action="store_true", help="Chrome penceresini göster")
+    parser.add_argument("--output", help="Sonuçları JSON olarak bu dosyaya yaz")
+    return parser.parse_args()
+
+def percentiles(values):
+    """p50/p95/p99 ve ortalama (ms) - en yakın sıra yöntemi"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))] * 1000
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(rank(50), 2),
+        "p95_ms": round(rank(95), 2),
+        "p99_ms": round(rank(99), 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2)
+    }
+
+class MockWhatsApp:
+    """Sahte sayfanın arka ucu - gelen mesaj kuyruğu ve teslim kayıtları"""
+
+    def __init__(self, ack_ms):
+        self.ack_ms = ack_ms
+        self.condition = threading.Condition()
+        self.inbound = []
+        self.deliveries = []    # (telefon, metin, zaman)
+        self.sequence = 0
+        self.page_loads = 0
+        self.fallback_loads = 0  # send?phone= ile tam sayfa yüklemesi - arama yolu tutmadığında
+
+    def inject(self, phone, text):
+        """Sayfaya gelen mesaj gönder - gönderim zamanını döndür"""
+        with self.condition:
+            self.sequence += 1
+            self.inbound.append({"phone": phone, "text": text, "id": f"BENCH{self.sequence:08d}"})
+            self.condition.notify_all()
+            return time.time()
+
+    def take_inbound(self, timeout=25):
+        """Uzun sorgu - gelen mesaj olana kadar bekle"""
+        with self.condition:
+            if not self.inbound:
+                self.condition.wait(timeout)
+            events, self.inbound = self.inbound, []
+            return events
+
+    def page_loaded(self, path):
+        with self.condition:
+            self.page_loads += 1
+            if "phone=" in path:
+                self.fallback_loads += 1
+
+    def delivered(self, phone, text):
+        with self.condition:
+            self.deliveries.append((phone, text, time.time()))
+            self.condition.notify_all()
+
+    def serve(self, port):
+        """Sahte sayfayı ve /bench uçlarını sunan HTTP sunucusu"""
+        mock = self
+        with open(MOCK_PAGE_PATH, encoding="utf-8") as f:
+            page = f.read().replace('data-ack-ms="30"', f'data-ack-ms="{self.ack_ms}"').encode("utf-8")
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def send_json(self, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith("/bench/inbound"):
+                    self.send_json(mock.take_inbound())
+                    return
+                # Diğer her adres (send?phone= dahil) sahte sayfayı döndürür
+                mock.page_loaded(self.path)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                data = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.startswith("/bench/delivered"):
+                    mock.delivered(data.get("phone"), data.get("text", ""))
+                self.send_json({"ok": True})
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+def bench_phone(i):
+    """Kural setine uyan sahte TR numarası"""
+    return f"+90555{i:07d}"
+
+def run_ingest(args, records):
+    """Eşzamanlı /otp POST'ları - gecikme dağılımı ve istek/sn"""
+    local = threading.local()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def post(record):
+        # Her istemci thread'i kendi keep-alive bağlantısını kullanır
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection("127.0.0.1", args.http_port, timeout=10)
+        body = json.dumps(record)
+        started = time.perf_counter()
+        try:
+            local.conn.request("POST", "/otp", body, {"Content-Type": "application/json"})
+            response = local.conn.getresponse()
+            response.read()
+            status = response.status
+        except Exception as e:
+            local.conn.close()
+            del local.conn
+            status = str(e)
+        elapsed = time.perf_counter() - started
+        with lock:
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(post, records))
+    duration = time.perf_counter() - started
+
+    return dict(
+        percentiles(latencies),
+        errors=len(errors),
+        duration_s=round(duration, 3),
+        throughput_rps=round(len(records) / duration, 1) if duration else None
+    )
+
+def run_delivery(args, mock, expected):
+    """Sahte gelen OTP talepleri - talepten cevabın tikine kadar geçen süre"""
+    phones = random.sample(sorted(expected), min(args.requests, len(expected)))
+    sent_at = {}
+
+    started = time.time()
+    for phone in phones:
+        sent_at[phone.lstrip("+")] = mock.inject(phone.lstrip("+"), "otp kodu lütfen")
+        time.sleep(1 / args.rate)
+
+    # Tüm cevaplar gelene ya da süre dolana kadar bekle
+    deadline = time.time() + args.timeout
+    with mock.condition:
+        while len(mock.deliveries) < len(phones) and time.time() < deadline:
+            mock.condition.wait(deadline - time.time())
+        deliveries = list(mock.deliveries)
+
+    latencies = []
+    wrong = 0
+    answered = set()
+    for phone, text, delivered_at in deliveries:
+        if phone not in sent_at or phone in answered:
+            continue
+        answered.add(phone)
+        latencies.append(delivered_at - sent_at[phone])
+        if expected["+" + phone] not in text:
+            wrong += 1
+    duration = (max(d[2] for d in deliveries) if deliveries else time.time()) - started
+
+    return dict(
+        percentiles(latencies),
+        requested=len(phones),
+        undelivered=len(phones) - len(answered),
+        wrong_code=wrong,
+        duration_s=round(duration, 3),
+        throughput_per_s=round(len(answered) / duration, 2) if duration > 0 else None
+    )
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="otp_bench_")
+
+    # Bot ayarları import'tan önce - kalıcı durum geçici klasöre, sayfa sahte sunucuya
+    os.environ.update({
+        "WHATSAPP_URL": f"http://127.0.0.1:{args.mock_port}",
+        "HTTP_HOST": "127.0.0.1",
+        "HTTP_PORT": str(args.http_port),
+        "CHROME_HEADLESS": "0" if args.headful else "1",
+        "SESSION_RESUME_TIMEOUT": "10",
+        "DEDUP_STATE_DIR": os.path.join(workdir, "state"),
+        "SELECTOR_CACHE_PATH": os.path.join(workdir, "selector_cache.json"),
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "OTP_DB_PATH": ""
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    import bot
+
+    mock = MockWhatsApp(args.ack_ms)
+    mock.serve(args.mock_port)
+
+    session = bot.WhatsAppBot(session_id="bench", profile_dir=os.path.join(workdir, "profile"))
+    bot.session_pool = bot.SessionPool([session])
+    threading.Thread(target=bot.otp_pool.run_expiry, daemon=True).start()
+    threading.Thread(target=session.run, daemon=True).start()
+    threading.Thread(target=bot.serve_http, daemon=True).start()
+
+    # Oturum sahte sayfaya bağlanana kadar bekle
+    deadline = time.time() + 60
+    while not session.is_available():
+        if time.time() > deadline:
+            print("❌ Oturum sahte sayfaya bağlanamadı", file=sys.stderr)
+            session.restart_driver()
+            return 1
+        time.sleep(0.2)
+
+    try:
+        expected = {}
+        records = []
+        for i in range(args.otps):
+            phone = bench_phone(i)
+            otp = f"{random.randint(0, 9999):04d}"
+            expected[phone] = otp
+            records.append({"tel": phone, "tur": "oluşturma", "otp": otp})
+
+        results = {
+            "config": vars(args),
+            "ingest": run_ingest(args, records),
+            "delivery": run_delivery(args, mock, expected),
+            "send_steps": session.step_timings.stats(),
+            "page_loads": {"total": mock.page_loads, "send_phone_fallback": mock.fallback_loads}
+        }
+    finally:
+        session.restart_driver()
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,9 +11,16 @@ import threading
 import tempfile
 import uuid
 import re
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+import hashlib
+import functools
+import heapq
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import Flask, Response, request, jsonify
 import json
+import sqlite3
 import os
 import sys
 from selenium import webdriver
@@ -23,85 +30,1656 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.keys import Keys
 import logging
+import logging.handlers
+import queue
+import atexit
+
+# Üretim WSGI sunucusu (opsiyonel) - yoksa werkzeug'un çok thread'li sunucusu kullanılır
+try:
+    from waitress import serve as waitress_serve
+except ImportError:
+    waitress_serve = None
+
+# Ortak OTP havuzu için Redis istemcisi (opsiyonel) - sadece OTP_POOL_BACKEND=redis ile gerekir
+try:
+    import redis
+except ImportError:
+    redis = None
 
 # Logging konfigürasyonu
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('whatsapp_bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FILE = os.environ.get("LOG_FILE", "whatsapp_bot.log")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", "20"))        # Aynı DEBUG satırından pencere başına en fazla kayıt
+LOG_RATE_WINDOW = float(os.environ.get("LOG_RATE_WINDOW", "60"))    # saniye
+
+# Log'a yazılan OTP kodlarını gizlemek için - "otp"/"kod" kelimesinden sonra gelen tek başına 4 hane
+OTP_IN_LOG_RE = re.compile(r'(?i)((?:otp|kod).{0,60}?)(?<![\d+])(\d{2})\d{2}(?!\d)')
+
+def mask_otp(otp):
+    """OTP'nin sadece ilk iki hanesini göster"""
+    return otp[:2] + "**" if otp else otp
+
+class OtpRedactFilter(logging.Filter):
+    """Log mesajlarındaki tam OTP kodlarını gizler"""
+    
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = OTP_IN_LOG_RE.sub(r'\1\2**', message)
+        if redacted != message:
+            record.msg = redacted
+            record.args = None
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """Döngü içindeki DEBUG kayıtlarını satır başına sınırlar - INFO ve üstü (iş kayıtları) hep geçer"""
+    
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.sites = {}  # {(dosya, satır): [pencere başı, sayı, bastırılan]}
+    
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self.sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if site[1] < self.limit:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+class JsonLogFormatter(logging.Formatter):
+    """Satır başına bir JSON kayıt"""
+    
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "suppressed", 0):
+            data["suppressed"] = record.suppressed
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+def setup_logging():
+    """Kuyruk tabanlı log hattı - çağıran thread diske/stdout'a yazmayı beklemez"""
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonLogFormatter())
+    
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    queue_handler.addFilter(OtpRedactFilter())
+    
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Flask uygulaması
 app = Flask(__name__)
 
-# OTP havuzu - {(telefon, tür): {"otp": kod, "timestamp": zaman}}
-otp_pool = {}
-otp_lock = threading.Lock()
+# Histogram kovaları (saniye) - milisaniyelik HTTP girişinden dakikalık gecikmeye kadar
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class Counter:
+    """Prometheus sayacı - en fazla bir etiket"""
+    
+    def __init__(self, name, help_text, label_name=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.lock = threading.Lock()
+        self.values = {}
+        metrics_registry.append(self)
+    
+    def inc(self, label=None, amount=1):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+                lines.append(f"{self.name}{format_labels(self.label_name, label)} {value}")
+        return lines
+
+class Histogram:
+    """Prometheus histogramı - en fazla bir etiket"""
+    
+    def __init__(self, name, help_text, label_name=None, buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}  # {etiket: [kova sayıları, toplam, adet]}
+        metrics_registry.append(self)
+    
+    def observe(self, value, label=None):
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label, (counts, total, count) in sorted(self.series.items(), key=lambda item: str(item[0])):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = format_labels(self.label_name, label, ("le", bound))
+                    lines.append(f"{self.name}_bucket{le} {bucket_count}")
+                lines.append(f"{self.name}_bucket{format_labels(self.label_name, label, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_name, label)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.label_name, label)} {count}")
+        return lines
+
+def format_labels(label_name, label, extra=None):
+    """Prometheus etiket metni - {adi="değer",le="..."}"""
+    pairs = []
+    if label_name and label is not None:
+        pairs.append((label_name, label))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def render_metrics():
+    """Tüm metrikler Prometheus metin formatında"""
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+metrics_registry = []
+
+# Sıcak yol metrikleri
+METRIC_INGEST_SECONDS = Histogram("otp_ingest_seconds", "OTP HTTP girişi süresi", "endpoint")
+METRIC_DETECTION_LAG_SECONDS = Histogram(
+    "otp_request_detection_lag_seconds", "Müşteri mesajının sayfada görülmesinden algılanmasına kadar geçen süre"
+)
+METRIC_LOOKUP_SECONDS = Histogram("otp_lookup_seconds", "OTP havuzu sorgu süresi")
+METRIC_SEND_STEP_SECONDS = Histogram("send_step_seconds", "Tarayıcı bekleme adımı süreleri", "step")
+METRIC_SEND_SECONDS = Histogram("send_message_seconds", "send_message toplam süresi", "result")
+METRIC_SWEEP_SECONDS = Histogram("listener_sweep_seconds", "Dinleyici döngüsü tur süresi", "session")
+METRIC_OTP_INGESTED = Counter("otp_ingested_total", "Havuza eklenen OTP sayısı")
+METRIC_OTP_LOOKUPS = Counter("otp_lookups_total", "OTP havuzu sorguları", "result")
+METRIC_OTP_EXPIRED = Counter("otp_expired_total", "Kullanılmadan süresi dolan OTP sayısı")
+METRIC_MESSAGES_SENT = Counter("messages_sent_total", "Gönderilen WhatsApp mesajları", "result")
+METRIC_OTP_PUSHED = Counter("otp_pushed_total", "Push modunda kuyruğa alınan OTP'ler", "result")
+METRIC_SEND_DEFERRED = Counter("send_deferred_total", "Hız sınırı nedeniyle ertelenen gönderimler", "scope")
+METRIC_REPLIES_SUPPRESSED = Counter("replies_suppressed_total", "Bastırılan tekrar 'OTP bulunamadı' cevapları")
+
+# OTP geçerlilik süresi (saniye)
+OTP_TTL_SECONDS = 300
+
+# Müşteriye giden OTP mesajı - talep (pull) ve push gönderimlerinde aynı metin
+OTP_REPLY_TEMPLATE = "🔐 OTP Kodunuz: {otp}\n\nBu kod 5 dakika geçerlidir."
+
+# Ülke kuralları - yeni ülke eklemek için bu tabloya satır eklemek yeterli
+# code: ülke kodu, national_length: ülke kodu olmadan numara uzunluğu,
+# mobile_prefix: ülke kodu/0 olmadan yazılmış yerel numaranın ilk hanesi
+PHONE_COUNTRY_RULES = [
+    {"country": "TR", "code": "90", "national_length": 10, "mobile_prefix": "5"},
+    {"country": "AL", "code": "355", "national_length": 9, "mobile_prefix": "6"},
+]
+
+NON_DIGIT_RE = re.compile(r'\D')
+URL_PHONE_RE = re.compile(r'phone=(\d+)')
+# Mesaj kimliğindeki kişi JID'i - "false_905551234567@c.us_3EB0..."
+MESSAGE_JID_RE = re.compile(r'^(?:true|false)_(\d{8,15})@c\.us_')
+# Kayıtsız numaranın sohbet başlığı - "+90 555 123 45 67"
+TITLE_PHONE_RE = re.compile(r'^\+?\d[\d\s().-]{8,18}\d$')
+
+# Her kural için tek regex: uluslararası (00/ülke kodu) veya yerel (0/mobil ön ek) yazım
+PHONE_RULE_PATTERNS = [
+    (rule["code"], re.compile(
+        rf'^(?:00)?{rule["code"]}(?P<intl>\d{{{rule["national_length"]}}})$'
+        rf'|^0?(?P<local>{rule["mobile_prefix"]}\d{{{rule["national_length"] - 1}}})$'
+    ))
+    for rule in PHONE_COUNTRY_RULES
+]
+
+@functools.lru_cache(maxsize=4096)
+def canonical_phone(phone):
+    """Telefon numarasını +<ülke kodu><numara> biçimine getir - giriş, havuz ve gönderimde ortak"""
+    if not phone:
+        return phone
+    
+    digits = NON_DIGIT_RE.sub('', phone)
+    for code, pattern in PHONE_RULE_PATTERNS:
+        match = pattern.match(digits)
+        if match:
+            return '+' + code + (match.group('intl') or match.group('local'))
+    
+    # Bilinmeyen ülke - uluslararası 00 ön ekini at
+    if digits.startswith('00'):
+        digits = digits[2:]
+    return '+' + digits
+
+# Gelen mesaj niyet sınıflandırıcı - tek regex, tek geçiş
+# Metin önce katlanır: büyük/küçük harf, İ/I/ı ve aksanlar (ş, ç, ğ, ö, ü) yok sayılır
+# "kod" sadece çekim ekleriyle eşleşir - "kodlama", "kodes" gibi başka kelimeler talep sayılmaz
+# kod + (lar) + iyelik (u, um, un, umuz, unuz) + hal eki (u, a, un, da, dan, la, dur) - "kodunuzu", "kodlarını", "koddur"
+INTENT_RE = re.compile(
+    r'\b(?:(?P<olusturma>olustur\w*)|(?P<duzenleme>duzenle\w*)'
+    r'|(?P<otp>otp|kod(?:lar)?(?:[iu][mn]?(?:[iu]z)?)?(?:n?[iua]|n?[iu]n|n?d[au]n?|la|d[iu]r)?))\b'
+)
+INTENT_TURS = {"olusturma": "oluşturma", "duzenleme": "düzenleme"}
+DEFAULT_TUR = "oluşturma"
+
+def fold_turkish(text):
+    """Karşılaştırma için Türkçe katlama - "OLUŞTURMA", "Olusturma", "oluşturma" aynı olur"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return stripped.casefold().replace("ı", "i")
+
+def classify_message(text):
+    """Mesajın niyeti ve türü - ("otp", tür) veya (None, None)"""
+    if not text:
+        return None, None
+    
+    tur = None
+    matched = False
+    for match in INTENT_RE.finditer(fold_turkish(text)):
+        matched = True
+        if match.lastgroup in INTENT_TURS:
+            tur = INTENT_TURS[match.lastgroup]
+            break
+    
+    if not matched:
+        return None, None
+    return "otp", tur or DEFAULT_TUR
+
+# Kalıcı OTP deposu (SQLite, WAL modu) - boş bırakılırsa havuz sadece bellekte tutulur
+OTP_DB_PATH = os.environ.get("OTP_DB_PATH", "")
+
+class SqliteOtpStore:
+    """OTP havuzunun SQLite (WAL) kopyası - yeniden başlatmada süresi dolmamış kayıtlar geri yüklenir"""
+    
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        # Çağrılar OtpPool kilidi altında yapılır
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS otps ("
+            " phone TEXT NOT NULL, tur TEXT NOT NULL, otp TEXT NOT NULL,"
+            " created_at REAL NOT NULL, expires_at REAL NOT NULL,"
+            " PRIMARY KEY (phone, tur))"
+        )
+    
+    def put_many(self, rows):
+        """[(telefon, tür, otp, oluşturma, son kullanma)] kayıtlarını tek işlemde yaz - yarım toplu kayıt kalmaz"""
+        # isolation_level=None (autocommit) bağlantıda "with conn" işlem açmaz, işlem açıkça başlatılır
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO otps VALUES (?, ?, ?, ?, ?)", rows)
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+    
+    def delete(self, key):
+        """Tek kaydı sil"""
+        self.conn.execute("DELETE FROM otps WHERE phone = ? AND tur = ?", key)
+    
+    def delete_expired(self, now):
+        """Süresi dolan kayıtları sil"""
+        self.conn.execute("DELETE FROM otps WHERE expires_at <= ?", (now,))
+    
+    def load_unexpired(self, now):
+        """Süresi dolmamış kayıtlar - [(telefon, tür, otp, oluşturma, son kullanma)]"""
+        return self.conn.execute(
+            "SELECT phone, tur, otp, created_at, expires_at FROM otps WHERE expires_at > ?", (now,)
+        ).fetchall()
+
+# OTP havuzu arka ucu - "memory": süreç içi (varsayılan), "redis": süreçler ve sunucular arası ortak havuz
+# Her iki arka uç aynı arayüzü sunar: put, put_many, take, expire, run_expiry, snapshot, stats, len()
+OTP_POOL_BACKEND = os.environ.get("OTP_POOL_BACKEND", "memory")
+OTP_REDIS_URL = os.environ.get("OTP_REDIS_URL", "redis://localhost:6379/0")
+OTP_REDIS_PREFIX = os.environ.get("OTP_REDIS_PREFIX", "otp:")
+
+class OtpPool:
+    """OTP havuzu - canonical telefon anahtarıyla tek sorgu, heap ile tam zamanında silme"""
+    
+    def __init__(self, ttl_seconds=OTP_TTL_SECONDS, store=None):
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self.condition = threading.Condition()
+        self.entries = {}     # {(canonical telefon, tür): {"otp", "timestamp", "expires_at"}}
+        self.heap = []        # [(expires_at, sıra, anahtar)] - eski kayıtlar tembel silinir
+        self.sequence = 0
+        if store:
+            self.restore()
+    
+    def restore(self):
+        """Kalıcı depodaki süresi dolmamış OTP'leri belleğe yükle"""
+        wall_now = time.time()
+        mono_now = time.monotonic()
+        with self.condition:
+            self.store.delete_expired(wall_now)
+            rows = self.store.load_unexpired(wall_now)
+            for phone, tur, otp, created_at, expires_wall in rows:
+                key = (phone, tur)
+                expires_at = mono_now + (expires_wall - wall_now)
+                self.entries[key] = {
+                    "otp": otp,
+                    "timestamp": datetime.fromtimestamp(created_at),
+                    "expires_at": expires_at
+                }
+                self.sequence += 1
+                heapq.heappush(self.heap, (expires_at, self.sequence, key))
+        logger.info(f"📂 {len(rows)} OTP kalıcı depodan yüklendi")
+    
+    def __len__(self):
+        with self.condition:
+            return len(self.entries)
+    
+    def put(self, phone, tur, otp):
+        """OTP ekle - aynı telefon/tür için eskisinin yerine geçer"""
+        self.put_many([(phone, tur, otp)])
+    
+    def put_many(self, entries):
+        """[(telefon, tür, otp)] kayıtlarını tek kilit altında ekle"""
+        expires_at = time.monotonic() + self.ttl_seconds
+        timestamp = datetime.now()
+        rows = []
+        with self.condition:
+            for phone, tur, otp in entries:
+                key = (canonical_phone(phone), tur)
+                self.entries[key] = {
+                    "otp": otp,
+                    "timestamp": timestamp,
+                    "expires_at": expires_at
+                }
+                self.sequence += 1
+                heapq.heappush(self.heap, (expires_at, self.sequence, key))
+                rows.append((key[0], tur, otp, timestamp.timestamp(), timestamp.timestamp() + self.ttl_seconds))
+            if self.store and rows:
+                self.store.put_many(rows)
+            if entries:
+                self.condition.notify()
+        METRIC_OTP_INGESTED.inc(amount=len(rows))
+    
+    def take(self, phone, tur):
+        """OTP'yi al ve sil - yoksa veya süresi dolmuşsa None"""
+        key = (canonical_phone(phone), tur)
+        with self.condition:
+            entry = self.entries.pop(key, None)
+            if entry is not None and self.store:
+                self.store.delete(key)
+        
+        if entry is None:
+            METRIC_OTP_LOOKUPS.inc("miss")
+            return None
+        if entry["expires_at"] <= time.monotonic():
+            logger.info(f"⏰ SÜRESİ DOLMUŞ: {key}")
+            METRIC_OTP_LOOKUPS.inc("expired")
+            METRIC_OTP_EXPIRED.inc()
+            return None
+        METRIC_OTP_LOOKUPS.inc("hit")
+        return entry["otp"]
+    
+    def expire(self):
+        """Süresi dolan kayıtları sil - bir sonraki son kullanma anına kalan süreyi döndürür"""
+        now = time.monotonic()
+        expired = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                expires_at, _, key = heapq.heappop(self.heap)
+                entry = self.entries.get(key)
+                # Yeniden eklenmiş veya alınmış kayıtlar atlanır
+                if entry is not None and entry["expires_at"] == expires_at:
+                    del self.entries[key]
+                    expired.append(key)
+            if expired and self.store:
+                self.store.delete_expired(time.time())
+            next_in = self.heap[0][0] - now if self.heap else None
+        
+        if expired:
+            METRIC_OTP_EXPIRED.inc(amount=len(expired))
+        for key in expired:
+            logger.info(f"🗑️ Süresi dolmuş OTP temizlendi: {key}")
+        return next_in
+    
+    def run_expiry(self):
+        """Süresi dolan OTP'leri tam zamanında silen döngü"""
+        while True:
+            try:
+                # Aynı kilit altında: araya giren ekleme bildirimi kaçmaz
+                with self.condition:
+                    next_in = self.expire()
+                    # Yeni kayıt eklenince uyanıp bekleme süresini yeniden hesapla
+                    self.condition.wait(next_in)
+            except Exception as e:
+                logger.error(f"OTP temizlemede hata: {e}")
+                time.sleep(1)
+    
+    def snapshot(self):
+        """Havuzdaki kayıtların kopyası - {anahtar: kayıt}"""
+        with self.condition:
+            return {key: dict(entry) for key, entry in self.entries.items()}
+    
+    def stats(self):
+        """Havuz durumu"""
+        return {
+            "backend": "memory",
+            "active": len(self),
+            "persistent": self.store is not None
+        }
+
+# GET + DEL tek atomik adım (Lua) - aynı kod iki süreçte birden alınamaz, GETDEL olmayan sürümlerde de çalışır
+# KEYS[1]: OTP anahtarı, KEYS[2]: süre dolumu sıralı indeks - alınan kayıt indeksten de çıkar
+REDIS_TAKE_LUA = (
+    "local v = redis.call('GET', KEYS[1]) "
+    "if v then redis.call('DEL', KEYS[1]) redis.call('ZREM', KEYS[2], KEYS[1]) end "
+    "return v"
+)
+
+class RedisOtpPool:
+    """Redis (veya uyumlu sunucu) üzerinde ortak OTP havuzu - birden fazla bot.py aynı havuzu kullanır"""
+    
+    def __init__(self, client, prefix=OTP_REDIS_PREFIX, ttl_seconds=OTP_TTL_SECONDS):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.index_key = f"{prefix}__index"   # {anahtar: süre dolum zamanı} - sayım ve listeleme SCAN'siz
+        self.take_script = client.register_script(REDIS_TAKE_LUA)
+    
+    def key(self, phone, tur):
+        return f"{self.prefix}{canonical_phone(phone)}|{tur}"
+    
+    def __len__(self):
+        # Süresi dolan anahtarları Redis siler, indeksten burada düşülür
+        pipeline = self.client.pipeline()
+        pipeline.zremrangebyscore(self.index_key, "-inf", time.time())
+        pipeline.zcard(self.index_key)
+        return pipeline.execute()[1]
+    
+    def put(self, phone, tur, otp):
+        """OTP ekle - aynı telefon/tür için eskisinin yerine geçer"""
+        self.put_many([(phone, tur, otp)])
+    
+    def put_many(self, entries):
+        """[(telefon, tür, otp)] kayıtlarını tek gidiş-dönüşte ekle - süre dolumunu Redis yapar"""
+        if not entries:
+            return
+        created_at = time.time()
+        pipeline = self.client.pipeline()
+        index = {}
+        for phone, tur, otp in entries:
+            key = self.key(phone, tur)
+            value = json.dumps({"otp": otp, "created_at": created_at})
+            pipeline.set(key, value, ex=self.ttl_seconds)
+            index[key] = created_at + self.ttl_seconds
+        pipeline.zadd(self.index_key, index)
+        pipeline.execute()
+        METRIC_OTP_INGESTED.inc(amount=len(entries))
+    
+    def take(self, phone, tur):
+        """OTP'yi atomik olarak al ve sil - yoksa veya süresi dolmuşsa None"""
+        value = self.take_script(keys=[self.key(phone, tur), self.index_key])
+        if value is None:
+            # Süresi dolan anahtarları Redis siler - dolmuş kayıt da "miss" sayılır
+            METRIC_OTP_LOOKUPS.inc("miss")
+            return None
+        METRIC_OTP_LOOKUPS.inc("hit")
+        return json.loads(value)["otp"]
+    
+    def expire(self):
+        """Süre dolumu Redis'te - yapılacak iş yok"""
+        return None
+    
+    def run_expiry(self):
+        """Redis anahtar süreleriyle silinir - temizlik thread'i gerekmez"""
+        logger.info("🗑️ OTP süre dolumu Redis tarafından yapılıyor")
+    
+    def snapshot(self):
+        """Havuzdaki kayıtların kopyası - {anahtar: kayıt}"""
+        keys = self.client.zrangebyscore(self.index_key, time.time(), "+inf")
+        if not keys:
+            return {}
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.get(key)
+            pipeline.pttl(key)
+        results = pipeline.execute()
+        
+        now = time.monotonic()
+        entries = {}
+        for index, key in enumerate(keys):
+            value, ttl_ms = results[2 * index], results[2 * index + 1]
+            if value is None:
+                continue
+            data = json.loads(value)
+            phone, tur = key[len(self.prefix):].rsplit("|", 1)
+            entries[(phone, tur)] = {
+                "otp": data["otp"],
+                "timestamp": datetime.fromtimestamp(data["created_at"]),
+                "expires_at": now + max(ttl_ms, 0) / 1000
+            }
+        return entries
+    
+    def stats(self):
+        """Havuz durumu"""
+        return {
+            "backend": "redis",
+            "active": len(self),
+            "prefix": self.prefix
+        }
+
+def create_otp_pool():
+    """OTP_POOL_BACKEND ayarına göre havuzu oluştur"""
+    if OTP_POOL_BACKEND == "redis":
+        if redis is None:
+            raise RuntimeError("OTP_POOL_BACKEND=redis için 'redis' paketi kurulu olmalı")
+        logger.info(f"🔗 Ortak OTP havuzu: Redis ({OTP_REDIS_PREFIX}*)")
+        return RedisOtpPool(redis.Redis.from_url(OTP_REDIS_URL, decode_responses=True))
+    
+    return OtpPool(store=SqliteOtpStore(OTP_DB_PATH) if OTP_DB_PATH else None)
+
+# OTP havuzu
+otp_pool = create_otp_pool()
 
 # WhatsApp Web driver
 driver = None
-whatsapp_ready = False
 
-class WhatsAppBot:
+# WhatsApp Web adresi - oturum başına bir kez yüklenir
+WHATSAPP_URL = os.environ.get("WHATSAPP_URL", "https://web.whatsapp.com")
+
+# Mesaj tarama modu - "js": tek execute_script çağrısı, "legacy": eski element taraması (sadece açıkça seçilirse)
+SCRAPER_MODE = os.environ.get("SCRAPER_MODE", "js")
+
+# Açık sohbetteki mesaj balonlarını tek seferde okuyan script - sondan başlar, imlece gelince durur
+# arguments[0]: en fazla balon, arguments[1]: sohbet imleci (son okunan mesaj kimliği) veya null
+# Dönüş: {"total": balon sayısı, "records": [{"id", "direction", "text", "timestamp"}]} veya sohbet açık değilse null
+MESSAGE_SCRAPER_JS = """
+var limit = arguments[0] || 50;
+var cursor = arguments[1] || null;
+var main = document.querySelector('#main');
+if (!main) { return null; }
+var rows = main.querySelectorAll('div[data-id]');
+var out = [];
+for (var i = rows.length - 1; i >= 0 && out.length < limit; i--) {
+    var row = rows[i];
+    if (row.parentElement && row.parentElement.closest('div[data-id]')) { continue; }
+    var id = row.getAttribute('data-id') || '';
+    if (cursor && id === cursor) { break; }
+    var direction = 'unknown';
+    if (row.classList.contains('message-in') || row.querySelector('.message-in')) {
+        direction = 'in';
+    } else if (row.classList.contains('message-out') || row.querySelector('.message-out')) {
+        direction = 'out';
+    } else if (id.indexOf('false_') === 0) {
+        direction = 'in';
+    } else if (id.indexOf('true_') === 0) {
+        direction = 'out';
+    }
+    var textEl = row.querySelector('span.selectable-text') || row.querySelector('.copyable-text span');
+    var pre = row.querySelector('[data-pre-plain-text]');
+    var stamp = pre ? (pre.getAttribute('data-pre-plain-text') || '').match(/^\\[([^\\]]+)\\]/) : null;
+    out.push({
+        id: id,
+        direction: direction,
+        text: textEl ? textEl.innerText : '',
+        timestamp: stamp ? stamp[1] : null
+    });
+}
+return {total: rows.length, records: out.reverse()};
+"""
+
+# Sohbet listesi ve açık sohbet için sayfa içi gözlemci
+# İlk çağrıda MutationObserver'ı kurar, her çağrıda kuyruktaki olayları boşaltır
+# Dönüş: {"installed": bool, "events": [...]}
+# Olaylar: {"type": "unread", "chat", "unread", "ts"} ve {"type": "message", "chat", "id", "text", "timestamp", "ts"}
+INBOUND_OBSERVER_JS = """
+var bot = window.__otpBot;
+if (!bot) {
+    bot = window.__otpBot = {queue: [], unread: {}, seen: {}, openChat: null, observer: null, pending: false};
+}
+var MAX_QUEUE = 500;
+
+function push(event) {
+    if (bot.queue.length >= MAX_QUEUE) { bot.queue.shift(); }
+    bot.queue.push(event);
+}
+
+function chatRows() {
+    var pane = document.querySelector('#pane-side');
+    if (!pane) { return []; }
+    var rows = pane.querySelectorAll("div[role='listitem'], div[role='row']");
+    if (!rows.length) { rows = pane.querySelectorAll("div[data-testid='cell-frame-container']"); }
+    return rows;
+}
+
+function unreadCount(row) {
+    var badge = row.querySelector("span[aria-label*='unread'], span[aria-label*='okunmamış'], [data-testid='icon-unread-count']");
+    if (!badge) { return 0; }
+    var n = parseInt((badge.innerText || '').replace(/\\D/g, ''), 10);
+    return isNaN(n) ? 1 : n;
+}
+
+function scanChatList() {
+    var rows = chatRows();
+    for (var i = 0; i < rows.length; i++) {
+        var titleEl = rows[i].querySelector('span[title]');
+        if (!titleEl) { continue; }
+        var chat = titleEl.getAttribute('title');
+        var count = unreadCount(rows[i]);
+        if (count > (bot.unread[chat] || 0)) {
+            push({type: 'unread', chat: chat, unread: count, ts: Date.now()});
+        }
+        bot.unread[chat] = count;
+    }
+}
+
+function openChatTitle() {
+    var header = document.querySelector('#main header span[title], #main header span[dir=auto]');
+    return header ? (header.getAttribute('title') || header.innerText) : null;
+}
+
+function scanOpenChat(nodes) {
+    var chat = openChatTitle();
+    // Sohbet değiştiyse yüklenen geçmiş mesajlar olay üretmesin
+    if (chat !== bot.openChat) {
+        bot.openChat = chat;
+        var loaded = document.querySelectorAll('#main div[data-id]');
+        for (var s = 0; s < loaded.length; s++) { bot.seen[loaded[s].getAttribute('data-id')] = true; }
+        return;
+    }
+    for (var i = 0; i < nodes.length; i++) {
+        var node = nodes[i];
+        if (node.nodeType !== 1) { continue; }
+        var rows = node.matches('div[data-id]') ? [node] : node.querySelectorAll('div[data-id]');
+        for (var j = 0; j < rows.length; j++) {
+            var row = rows[j];
+            var id = row.getAttribute('data-id') || '';
+            if (bot.seen[id] || !row.closest('#main')) { continue; }
+            var inbound = row.classList.contains('message-in') || row.querySelector('.message-in') || id.indexOf('false_') === 0;
+            if (!inbound) { continue; }
+            bot.seen[id] = true;
+            var textEl = row.querySelector('span.selectable-text') || row.querySelector('.copyable-text span');
+            var pre = row.querySelector('[data-pre-plain-text]');
+            var stamp = pre ? (pre.getAttribute('data-pre-plain-text') || '').match(/^\\[([^\\]]+)\\]/) : null;
+            push({
+                type: 'message',
+                chat: chat,
+                id: id,
+                text: textEl ? textEl.innerText : '',
+                timestamp: stamp ? stamp[1] : null,
+                ts: Date.now()
+            });
+        }
+    }
+}
+
+if (!bot.observer) {
+    var root = document.querySelector('#app') || document.body;
+    if (!document.querySelector('#pane-side')) {
+        return {installed: false, events: []};
+    }
+    // Mevcut mesajları "görüldü" say, sadece sonradan gelenler olay üretsin
+    var existing = document.querySelectorAll('#main div[data-id]');
+    for (var k = 0; k < existing.length; k++) { bot.seen[existing[k].getAttribute('data-id')] = true; }
+    bot.openChat = openChatTitle();
+    bot.observer = new MutationObserver(function (mutations) {
+        var added = [];
+        for (var m = 0; m < mutations.length; m++) {
+            var list = mutations[m].addedNodes;
+            for (var a = 0; a < list.length; a++) { added.push(list[a]); }
+        }
+        if (added.length) { scanOpenChat(added); }
+        // Sohbet listesi taramasını birleştir - her mutasyonda değil, 100ms'de bir
+        if (!bot.pending) {
+            bot.pending = true;
+            setTimeout(function () { bot.pending = false; scanChatList(); }, 100);
+        }
+    });
+    bot.observer.observe(root, {childList: true, subtree: true, characterData: true});
+    scanChatList();
+}
+
+var events = bot.queue;
+bot.queue = [];
+return {installed: true, events: events};
+"""
+
+# Başlığı verilen sohbet satırını döndüren script
+FIND_CHAT_ROW_JS = """
+var title = arguments[0];
+var spans = document.querySelectorAll('#pane-side span[title]');
+for (var i = 0; i < spans.length; i++) {
+    if (spans[i].getAttribute('title') === title) {
+        return spans[i].closest("div[role='listitem'], div[role='row'], div[data-testid='cell-frame-container']") || spans[i];
+    }
+}
+return null;
+"""
+
+# Arama sonrası başlığı verilen numara olan sohbet satırı - başlıktaki boşluk, + ve tireler yok sayılır
+FIND_PHONE_ROW_JS = """
+var digits = arguments[0];
+var spans = document.querySelectorAll('#pane-side span[title]');
+for (var i = 0; i < spans.length; i++) {
+    if ((spans[i].getAttribute('title') || '').replace(/\\D/g, '') === digits) {
+        return spans[i].closest("div[role='listitem'], div[role='row'], div[data-testid='cell-frame-container']") || spans[i];
+    }
+}
+return null;
+"""
+
+# Odaklanan mesaj kutusuna metin ekleyen script (emoji dahil, BMP dışı karakterler için)
+INSERT_TEXT_JS = """
+arguments[0].focus();
+document.execCommand('insertText', false, arguments[1]);
+"""
+
+# Rol başına varsayılan selector'lar - SelectorResolver en son çalışanı öne alır
+SELECTOR_DEFAULTS = {
+    "send_button": [
+        "span[aria-label='Send']",  # YENİ - Test kodunda çalışan
+        "button[aria-label='Send']",
+        "[data-testid='compose-btn-send']",  # ESKİ fallback
+        "span[data-icon='send']",
+        "button[data-testid='send']",
+        "div[role='button'][aria-label='Send']"
+    ],
+    "compose_box": [
+        "footer div[contenteditable='true']",
+        "div[contenteditable='true'][data-tab='10']",
+        "[data-testid='conversation-compose-box-input']"
+    ],
+    "search_box": [
+        "#side div[contenteditable='true']",
+        "#side input[type='text']",
+        "div[contenteditable='true'][data-tab='3']"
+    ],
+    "chat_header": [
+        "header span",
+        "h1", "h2", "h3",
+        "[data-testid='conversation-header'] span",
+        "span[title]",
+        "div[data-testid='conversation-header'] span",
+        "header div span"
+    ]
+}
+
+# Öğrenilen selector sıralamasının saklandığı dosya
+SELECTOR_CACHE_PATH = os.environ.get("SELECTOR_CACHE_PATH", "selector_cache.json")
+
+# Selector listesini sırayla tek çağrıda dener
+# arguments: [selector'lar, sadece tıklanabilir, tüm eşleşmeler]
+# Dönüş: [selector, element] / [selector, [elementler]] veya null
+SELECTOR_PROBE_JS = """
+var selectors = arguments[0], clickable = arguments[1], all = arguments[2];
+for (var i = 0; i < selectors.length; i++) {
+    var found;
+    try { found = document.querySelectorAll(selectors[i]); } catch (e) { continue; }
+    var hits = [];
+    for (var j = 0; j < found.length; j++) {
+        var el = found[j];
+        if (clickable && (el.offsetParent === null || el.disabled || el.getAttribute('aria-disabled') === 'true')) { continue; }
+        hits.push(el);
+        if (!all) { break; }
+    }
+    if (hits.length) { return [selectors[i], all ? hits : hits[0]]; }
+}
+return null;
+"""
+
+# Açık sohbetin telefonunu tek çağrıda bul - önce mesaj kimliğindeki JID, sonra başlık
+# arguments[0]: başlık selector'ları (öğrenilen sırayla)
+# Dönüş: {"chat", "phone", "source", "selector"}
+CHAT_PHONE_JS = """
+var result = {chat: null, phone: null, source: null, selector: null};
+var main = document.querySelector('#main');
+if (!main) { return result; }
+var titleEl = main.querySelector('header span[title]');
+result.chat = titleEl ? titleEl.getAttribute('title') : null;
+
+var rows = main.querySelectorAll('div[data-id]');
+for (var i = rows.length - 1; i >= 0; i--) {
+    var jid = (rows[i].getAttribute('data-id') || '').match(/^(?:true|false)_(\\d{8,15})@c\\.us_/);
+    if (jid) {
+        result.phone = jid[1];
+        result.source = 'jid';
+        return result;
+    }
+}
+
+var phonePattern = /\\+?\\d[\\d\\s-]{8,18}\\d/;
+var selectors = arguments[0] || [];
+for (var s = 0; s < selectors.length; s++) {
+    var found;
+    try { found = main.querySelectorAll(selectors[s]); } catch (e) { continue; }
+    for (var j = 0; j < found.length; j++) {
+        var match = (found[j].getAttribute('title') || found[j].innerText || '').match(phonePattern);
+        if (match) {
+            result.phone = match[0];
+            result.source = 'header';
+            result.selector = selectors[s];
+            return result;
+        }
+    }
+}
+return result;
+"""
+
+# Açık sohbetin başlığı verilen başlıkla eşleşiyor mu
+CHAT_HEADER_MATCHES_JS = """
+var header = document.querySelector('#main header span[title]');
+return !!header && header.getAttribute('title') === arguments[0];
+"""
+
+# Son giden mesajda gönderim işareti (tik) çizildi mi
+# arguments[0]: gönderimden önceki giden mesaj sayısı
+OUTGOING_TICK_JS = """
+var rows = document.querySelectorAll('#main .message-out');
+if (rows.length <= arguments[0]) { return false; }
+return !!rows[rows.length - 1].querySelector("span[data-icon='msg-check'], span[data-icon='msg-dblcheck'], span[data-icon='msg-dblcheck-ack']");
+"""
+
+# Bekleme adımları ve zaman aşımları (saniye) - WAIT_TIMEOUT_<ADIM> ile değiştirilebilir
+WAIT_TIMEOUTS = {
+    step: float(os.environ.get(f"WAIT_TIMEOUT_{step.upper()}", default))
+    for step, default in {
+        "chat_search": 5,        # Aramada numaranın sohbet satırı listelendi
+        "chat_switch": 10,       # Önceki sohbet paneli kaldırıldı
+        "compose_box": 10,       # Mesaj kutusu tıklanabilir
+        "compose_box_fallback": 30,
+        "send_button": 10,       # Gönder butonu tıklanabilir
+        "message_tick": 10,      # Giden mesajda tik çizildi
+        "chat_header": 5,        # Sohbet başlığı beklenen sohbet
+        "chat_phone": 5,         # Açılan sohbetin telefonu gönderilecek numara
+        "chat_list": 30,         # Sayfa yüklendikten sonra sohbet listesi
+        "messages_loaded": 5     # Sohbette mesaj balonları yüklendi
+    }.items()
+}
+
+# Gözlemci olaylarının boşaltılma aralığı (saniye) - iş varsa MIN'e iner, boştayken MAX'a kadar uzar
+LISTEN_POLL_INTERVAL = float(os.environ.get("LISTEN_POLL_INTERVAL", "1"))
+LISTEN_POLL_MIN = float(os.environ.get("LISTEN_POLL_MIN", "0.2"))
+LISTEN_POLL_MAX = float(os.environ.get("LISTEN_POLL_MAX", "5"))
+LISTEN_POLL_BACKOFF = float(os.environ.get("LISTEN_POLL_BACKOFF", "1.5"))
+
+# Bir turda açılacak en fazla sohbet - kalanlar sırada bekler, sonraki turda önce onlar açılır
+CHAT_VISIT_BUDGET = int(os.environ.get("CHAT_VISIT_BUDGET", "5"))
+
+# Açılamayan sohbet kaç turda yeniden denenir - sonra sıradan düşer, sonraki okunmamış olayı tekrar ekler
+CHAT_VISIT_RETRIES = int(os.environ.get("CHAT_VISIT_RETRIES", "3"))
+
+# Aynı telefon/tür için tekrar eden cevapların birleştirildiği süre (saniye)
+SEND_COALESCE_WINDOW = float(os.environ.get("SEND_COALESCE_WINDOW", "30"))
+
+# Tarama adımları arasında işlenecek en fazla gönderim sayısı
+SEND_BUDGET_PER_CYCLE = int(os.environ.get("SEND_BUDGET_PER_CYCLE", "3"))
+
+# Gönderim hız sınırları (token bucket) - WhatsApp'ın hesabı yavaşlatmaması/işaretlememesi için
+SEND_RATE_PER_SESSION = float(os.environ.get("SEND_RATE_PER_SESSION", "0.5"))   # Oturum başına mesaj/sn
+SEND_BURST_PER_SESSION = int(os.environ.get("SEND_BURST_PER_SESSION", "10"))
+SEND_RATE_PER_PHONE = float(os.environ.get("SEND_RATE_PER_PHONE", "0.1"))       # Alıcı başına mesaj/sn
+SEND_BURST_PER_PHONE = int(os.environ.get("SEND_BURST_PER_PHONE", "3"))
+SEND_RATE_MAX_PHONES = 5000   # Bu kadar alıcı kovası birikince dolmuş olanlar atılır
+
+# Aynı telefona tekrar "OTP bulunamadı" cevabı verilmeyen süre (saniye)
+NOT_FOUND_SUPPRESS_SECONDS = float(os.environ.get("NOT_FOUND_SUPPRESS_SECONDS", "60"))
+
+class SelectorResolver:
+    """Rol başına en son çalışan selector'ı hatırlar ve önce onu dener"""
+    
+    def __init__(self, defaults=SELECTOR_DEFAULTS, cache_path=SELECTOR_CACHE_PATH):
+        self.lock = threading.Lock()
+        self.cache_path = cache_path
+        self.rankings = {role: list(selectors) for role, selectors in defaults.items()}
+        self.load()
+    
+    def load(self):
+        """Kayıtlı sıralamayı yükle - artık olmayan selector'lar atılır, yeniler sona eklenir"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.warning(f"Selector önbelleği okunamadı: {e}")
+            return
+        
+        for role, selectors in self.rankings.items():
+            learned = [sel for sel in saved.get(role, []) if sel in selectors]
+            self.rankings[role] = learned + [sel for sel in selectors if sel not in learned]
+    
+    def save(self):
+        """Sıralamayı diske yaz"""
+        if not self.cache_path:
+            return
+        try:
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.rankings, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.warning(f"Selector önbelleği yazılamadı: {e}")
+    
+    def ordered(self, role):
+        """Rolün selector'ları - en son çalışan önde"""
+        with self.lock:
+            return list(self.rankings[role])
+    
+    def record_success(self, role, selector):
+        """Çalışan selector'ı başa al, sıralama değiştiyse kaydet"""
+        with self.lock:
+            ranking = self.rankings[role]
+            if ranking[0] == selector:
+                return
+            ranking.remove(selector)
+            ranking.insert(0, selector)
+            self.save()
+        logger.info(f"🧭 Selector sıralaması güncellendi ({role}): {selector}")
+    
+    def find(self, driver, role, clickable=False):
+        """Rol için ilk eşleşen elementi tek çağrıda bul - yoksa None"""
+        result = driver.execute_script(SELECTOR_PROBE_JS, self.ordered(role), clickable, False)
+        if not result:
+            return None
+        selector, element = result
+        self.record_success(role, selector)
+        return element
+
+# İşlenmiş mesaj kimliklerinin tutulduğu kapasite ve kalıcı kayıt klasörü (boş: kapalı)
+DEDUP_CAPACITY = int(os.environ.get("DEDUP_CAPACITY", "5000"))
+DEDUP_STATE_DIR = os.environ.get("DEDUP_STATE_DIR", "state")
+
+class AppendLog:
+    """Satır başına bir kayıt tutan kalıcı dosya - kapasitenin iki katı satıra ulaşınca güncel durumla yeniden yazılır"""
+    
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.lines = 0
+    
+    def read(self):
+        """Dosyadaki boş olmayan satırlar, eskiden yeniye - dosya yoksa boş liste"""
+        if not self.path or not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            lines = [line.rstrip("\n") for line in f]
+        lines = [line for line in lines if line]
+        self.lines = len(lines)
+        return lines
+    
+    def append(self, line, current):
+        """Satırı ekle - dosya kapasitenin iki katına ulaştıysa current() satırlarıyla sıkıştır"""
+        if not self.path:
+            return
+        if self.lines >= self.capacity * 2:
+            lines = list(current())
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(f"{item}\n" for item in lines)
+            os.replace(tmp_path, self.path)
+            self.lines = len(lines)
+        else:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{line}\n")
+            self.lines += 1
+
+class DedupCache:
+    """Sabit kapasiteli, ekleme sıralı işlenmiş mesaj kümesi - en eski kimlik O(1) atılır"""
+    
+    def __init__(self, capacity=DEDUP_CAPACITY, path=None):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.log = AppendLog(path, capacity)
+        self.load()
+    
+    def __contains__(self, msg_id):
+        with self.lock:
+            return msg_id in self.items
+    
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+    
+    def add(self, msg_id):
+        """Kimliği ekle - zaten varsa False (kontrol ve ekleme tek adımda)"""
+        with self.lock:
+            if msg_id in self.items:
+                return False
+            self.items[msg_id] = None
+            if len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+            try:
+                self.log.append(msg_id, lambda: self.items)
+            except Exception as e:
+                logger.warning(f"İşlenmiş mesaj kaydı yazılamadı: {e}")
+            return True
+    
+    def load(self):
+        """Kalıcı kayıttan son kimlikleri yükle"""
+        try:
+            lines = self.log.read()
+        except Exception as e:
+            logger.warning(f"İşlenmiş mesaj kaydı okunamadı: {e}")
+            return
+        if not lines:
+            return
+        for msg_id in lines:
+            self.items[msg_id] = None
+            self.items.move_to_end(msg_id)
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+        logger.info(f"📂 {len(self.items)} işlenmiş mesaj kimliği yüklendi: {self.log.path}")
+
+class ChatCursors:
+    """Sohbet başına son okunan mesaj kimliği - her ziyarette sadece imleçten yeni balonlar okunur"""
+    
+    def __init__(self, capacity=DEDUP_CAPACITY, path=None):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.cursors = OrderedDict()   # {canonical telefon: mesaj kimliği}
+        self.log = AppendLog(path, capacity)
+        self.load()
+    
+    def __len__(self):
+        with self.lock:
+            return len(self.cursors)
+    
+    def get(self, phone):
+        with self.lock:
+            return self.cursors.get(phone)
+    
+    def set(self, phone, msg_id):
+        """İmleci ilerlet - değişmediyse diske yazılmaz"""
+        with self.lock:
+            if self.cursors.get(phone) == msg_id:
+                return
+            self.cursors[phone] = msg_id
+            self.cursors.move_to_end(phone)
+            if len(self.cursors) > self.capacity:
+                self.cursors.popitem(last=False)
+            try:
+                self.log.append(
+                    f"{phone}\t{msg_id}", lambda: (f"{key}\t{value}" for key, value in self.cursors.items())
+                )
+            except Exception as e:
+                logger.warning(f"Sohbet imleci yazılamadı: {e}")
+    
+    def load(self):
+        """Kalıcı kayıttan imleçleri yükle - aynı sohbet için son satır geçerli"""
+        try:
+            lines = self.log.read()
+        except Exception as e:
+            logger.warning(f"Sohbet imleçleri okunamadı: {e}")
+            return
+        if not lines:
+            return
+        for line in lines:
+            phone, _, msg_id = line.partition("\t")
+            if phone and msg_id:
+                self.cursors[phone] = msg_id
+                self.cursors.move_to_end(phone)
+        while len(self.cursors) > self.capacity:
+            self.cursors.popitem(last=False)
+        logger.info(f"📂 {len(self.cursors)} sohbet imleci yüklendi: {self.log.path}")
+
+class ChatScheduler:
+    """Okunmamış sohbet sırası - en eski bekleyen talep önce, yoklama aralığı yüke göre değişir"""
+    
+    def __init__(self, min_interval=LISTEN_POLL_MIN, max_interval=LISTEN_POLL_MAX, backoff=LISTEN_POLL_BACKOFF,
+                 retries=CHAT_VISIT_RETRIES):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.retries = retries
+        self.interval = LISTEN_POLL_INTERVAL
+        self.pending = {}   # {sohbet başlığı: (ilk görülme ms, -liste sırası)}
+        self.attempts = {}  # {sohbet başlığı: başarısız ziyaret sayısı}
+        self.visited = 0
+        self.dropped = 0
+    
+    def add(self, chat, seen_at=None, position=0):
+        """Okunmamış mesajı olan sohbeti sıraya ekle - zaten bekliyorsa ilk görülme zamanı korunur"""
+        if chat not in self.pending:
+            # Aynı anda görülenlerde listede aşağıda olan (daha eski) önce
+            self.pending[chat] = (seen_at or time.time() * 1000, -position)
+    
+    def next_chats(self, limit=CHAT_VISIT_BUDGET):
+        """Açılacak sohbetler - en eski bekleyen önce"""
+        return sorted(self.pending, key=self.pending.get)[:limit]
+    
+    def seen_at(self, chat):
+        """Sohbetin okunmamış olarak ilk görüldüğü an (ms)"""
+        entry = self.pending.get(chat)
+        return entry[0] if entry else None
+    
+    def done(self, chat):
+        """Sohbet ziyaret edildi"""
+        self.pending.pop(chat, None)
+        self.attempts.pop(chat, None)
+        self.visited += 1
+    
+    def failed(self, chat):
+        """Ziyaret başarısız - sohbet ilk görülme zamanıyla sırada kalır, deneme hakkı bitince düşer"""
+        self.attempts[chat] = self.attempts.get(chat, 0) + 1
+        if self.attempts[chat] < self.retries:
+            return True
+        
+        self.pending.pop(chat, None)
+        self.attempts.pop(chat, None)
+        self.dropped += 1
+        return False
+    
+    def next_interval(self, busy):
+        """Sonraki yoklamaya kadar bekleme - iş varsa kısalır, boştayken geri çekilir"""
+        if busy or self.pending:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, max(self.interval, self.min_interval) * self.backoff)
+        return self.interval
+    
+    def stats(self):
+        """Sıra durumu"""
+        return {
+            "pending_chats": len(self.pending),
+            "visited": self.visited,
+            "dropped": self.dropped,
+            "poll_interval_seconds": round(self.interval, 3)
+        }
+
+class StepTimings:
+    """Bekleme adımlarının ölçülen süreleri - zaman aşımlarını gerçek sayılara göre ayarlamak için"""
+    
     def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = {}
+    
+    def record(self, step, duration, timed_out):
+        """Bir bekleme süresini kaydet"""
+        METRIC_SEND_STEP_SECONDS.observe(duration, step)
+        with self.lock:
+            data = self.steps.setdefault(step, {
+                "count": 0, "timeouts": 0, "total": 0.0, "max": 0.0, "last": 0.0
+            })
+            data["count"] += 1
+            data["total"] += duration
+            data["max"] = max(data["max"], duration)
+            data["last"] = duration
+            if timed_out:
+                data["timeouts"] += 1
+    
+    def stats(self):
+        """Adım başına ortalama/en yüksek/son süreler"""
+        with self.lock:
+            return {
+                step: {
+                    "count": data["count"],
+                    "timeouts": data["timeouts"],
+                    "avg_seconds": round(data["total"] / data["count"], 3),
+                    "max_seconds": round(data["max"], 3),
+                    "last_seconds": round(data["last"], 3),
+                    "timeout_seconds": WAIT_TIMEOUTS.get(step)
+                }
+                for step, data in self.steps.items()
+            }
+
+def reply_downgrades(current, incoming):
+    """Yeni cevap bekleyen kod cevabını hata cevabıyla değiştirir mi"""
+    return current == "otp" and incoming == "not_found"
+
+class OutboundQueue:
+    """Giden mesaj kuyruğu - aynı telefon/tür için cevapları birleştirir"""
+    
+    def __init__(self, coalesce_window=SEND_COALESCE_WINDOW):
+        self.coalesce_window = coalesce_window
+        self.condition = threading.Condition()
+        self.order = deque()      # Sıradaki (telefon, tür) anahtarları
+        self.pending = {}         # {(telefon, tür): iş}
+        self.recent = {}          # {(telefon, tür): (mesaj, gönderim zamanı)}
+        self.enqueued = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.failed = 0
+        self.requeued = 0
+        self.deferred = 0
+        self.paused_until = 0.0
+        self.waited = 0           # Bekleme süresi kaydedilen (gönderime alınan) iş sayısı
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+    
+    def put(self, phone, tur, message, kind="otp"):
+        """İşi kuyruğa ekle - birleştirildiyse False döner
+        
+        kind: "otp" (kod cevabı) ya da "not_found" (hata cevabı) - hata cevabı bekleyen kod cevabının yerini almaz
+        """
+        key = (phone, tur)
+        now = time.time()
+        with self.condition:
+            # Aynı cevap pencere içinde zaten gönderildiyse tekrar gönderme
+            recent = self.recent.get(key)
+            if recent and recent[0] == message and now - recent[1] < self.coalesce_window:
+                self.coalesced += 1
+                return False
+            
+            # Bekleyen iş varsa sadece mesajı güncelle, sıradaki yeri korunur
+            if key in self.pending:
+                if not reply_downgrades(self.pending[key]["kind"], kind):
+                    self.pending[key].update(message=message, kind=kind)
+                self.coalesced += 1
+                return False
+            
+            self.pending[key] = {
+                "phone": phone,
+                "tur": tur,
+                "message": message,
+                "kind": kind,
+                "enqueued_at": now
+            }
+            self.order.append(key)
+            self.enqueued += 1
+            self.condition.notify_all()
+            return True
+    
+    def get_nowait(self):
+        """Sıradaki hazır işi al - kuyruk boşsa veya tüm işler ertelenmişse None"""
+        now = time.time()
+        with self.condition:
+            if now < self.paused_until:
+                return None
+            for index, key in enumerate(self.order):
+                if self.pending[key].get("not_before", 0) <= now:
+                    break
+            else:
+                return None
+            del self.order[index]
+            job = self.pending.pop(key)
+            # Bekleme süresi gönderim sonucunda kaydedilir - ertelenip tekrar alınan iş bir kez sayılır
+            job["taken_at"] = now
+            return job
+    
+    def requeue(self, job, not_before=None):
+        """Tamamlanamayan işi sıranın başına geri koy - bu arada aynı anahtar için gelen yeni mesaj korunur
+        
+        not_before verilirse iş o zamana kadar ertelenir (hız sınırı)
+        """
+        key = (job["phone"], job["tur"])
+        with self.condition:
+            if key in self.pending:
+                self.order.remove(key)
+                newer = self.pending[key]
+                if not reply_downgrades(job["kind"], newer["kind"]):
+                    job = dict(job, message=newer["message"], kind=newer["kind"])
+            if not_before:
+                job = dict(job, not_before=not_before)
+                self.deferred += 1
+            else:
+                job.pop("not_before", None)
+                self.requeued += 1
+            self.pending[key] = job
+            self.order.appendleft(key)
+            self.condition.notify_all()
+    
+    def next_ready_in(self):
+        """Sıradaki hazır işe kalan süre - kuyruk boşsa None (kilit altında çağrılır)"""
+        if not self.order:
+            return None
+        earliest = min(self.pending[key].get("not_before", 0) for key in self.order)
+        return max(0.0, earliest - time.time(), self.paused_until - time.time())
+    
+    def pause(self, until):
+        """Verilen zamana kadar hiçbir iş verme (oturum hız sınırı doldu)"""
+        with self.condition:
+            self.paused_until = max(self.paused_until, until)
+    
+    def wait_for_job(self, timeout):
+        """Hazır iş olana kadar en fazla timeout saniye bekle"""
+        with self.condition:
+            ready_in = self.next_ready_in()
+            if ready_in is None or ready_in > 0:
+                self.condition.wait(timeout if ready_in is None else min(timeout, ready_in))
+            return self.next_ready_in() == 0
+    
+    def mark_done(self, job, success):
+        """Gönderim sonucunu kaydet"""
+        with self.condition:
+            wait = job["taken_at"] - job["enqueued_at"]
+            self.waited += 1
+            self.last_wait = wait
+            self.max_wait = max(self.max_wait, wait)
+            self.total_wait += wait
+            
+            if success:
+                self.sent += 1
+                self.recent[(job["phone"], job["tur"])] = (job["message"], time.time())
+                
+                # Pencere dışına çıkan kayıtları temizle
+                if len(self.recent) > 500:
+                    cutoff = time.time() - self.coalesce_window
+                    self.recent = {k: v for k, v in self.recent.items() if v[1] >= cutoff}
+            else:
+                self.failed += 1
+    
+    def stats(self):
+        """Kuyruk derinliği ve bekleme süreleri"""
+        with self.condition:
+            oldest_wait = 0.0
+            if self.order:
+                oldest_wait = time.time() - self.pending[self.order[0]]["enqueued_at"]
+            now = time.time()
+            return {
+                "depth": len(self.order),
+                "deferred_depth": sum(1 for key in self.order if self.pending[key].get("not_before", 0) > now),
+                "oldest_wait_seconds": round(oldest_wait, 3),
+                "last_wait_seconds": round(self.last_wait, 3),
+                "avg_wait_seconds": round(self.total_wait / self.waited, 3) if self.waited else 0.0,
+                "max_wait_seconds": round(self.max_wait, 3),
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "sent": self.sent,
+                "failed": self.failed,
+                "requeued": self.requeued,
+                "deferred": self.deferred
+            }
+
+class TokenBucket:
+    """Token bucket - rate token/sn dolar, en fazla capacity birikir"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+    
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+    
+    def wait_time(self, now):
+        """Bir token için beklenecek süre - 0 ise hemen alınabilir"""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+    
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+class SendRateLimiter:
+    """Oturum ve alıcı başına gönderim sınırı - sınırı aşan gönderim düşürülmez, ertelenir"""
+    
+    def __init__(self, session_rate=SEND_RATE_PER_SESSION, session_burst=SEND_BURST_PER_SESSION,
+                 phone_rate=SEND_RATE_PER_PHONE, phone_burst=SEND_BURST_PER_PHONE,
+                 suppress_window=NOT_FOUND_SUPPRESS_SECONDS):
+        self.lock = threading.Lock()
+        self.session_bucket = TokenBucket(session_rate, session_burst)
+        self.phone_rate = phone_rate
+        self.phone_burst = phone_burst
+        self.phone_buckets = {}     # {telefon: TokenBucket}
+        self.suppress_window = suppress_window
+        self.last_not_found = {}    # {telefon: son "bulunamadı" cevabı zamanı}
+        self.deferred = {"session": 0, "phone": 0}
+        self.suppressed = 0
+    
+    def reserve(self, phone):
+        """Gönderim için token al - (0, None) hemen gönder, yoksa (bekleme süresi, sınırlayan kapsam)"""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.phone_buckets.get(phone)
+            if bucket is None:
+                if len(self.phone_buckets) >= SEND_RATE_MAX_PHONES:
+                    self.prune(now)
+                bucket = self.phone_buckets[phone] = TokenBucket(self.phone_rate, self.phone_burst)
+            
+            # İkisinde de token varsa ikisinden de al - biri yoksa hiçbirine dokunma
+            session_wait = self.session_bucket.wait_time(now)
+            phone_wait = bucket.wait_time(now)
+            if session_wait > 0 or phone_wait > 0:
+                scope = "session" if session_wait >= phone_wait else "phone"
+                self.deferred[scope] += 1
+                METRIC_SEND_DEFERRED.inc(scope)
+                # Küçük pay - token tam dolmadan uyanıp tekrar ertelenmesin
+                return max(session_wait, phone_wait) + 0.01, scope
+            
+            self.session_bucket.tokens -= 1
+            bucket.tokens -= 1
+            return 0.0, None
+    
+    def prune(self, now):
+        """Dolmuş (uzun süredir gönderim olmayan) alıcı kovalarını at"""
+        self.phone_buckets = {p: b for p, b in self.phone_buckets.items() if not b.is_full(now)}
+        cutoff = now - self.suppress_window
+        self.last_not_found = {p: t for p, t in self.last_not_found.items() if t > cutoff}
+    
+    def allow_not_found_reply(self, phone):
+        """Aynı telefona pencere içinde ikinci "bulunamadı" cevabı verilmez"""
+        now = time.monotonic()
+        with self.lock:
+            last = self.last_not_found.get(phone)
+            if last is not None and now - last < self.suppress_window:
+                self.suppressed += 1
+                METRIC_REPLIES_SUPPRESSED.inc()
+                return False
+            self.last_not_found[phone] = now
+            return True
+    
+    def stats(self):
+        """Sınır durumu ve erteleme sayıları"""
+        now = time.monotonic()
+        with self.lock:
+            self.session_bucket.refill(now)
+            return {
+                "session_tokens": round(self.session_bucket.tokens, 2),
+                "tracked_phones": len(self.phone_buckets),
+                "deferred_session": self.deferred["session"],
+                "deferred_phone": self.deferred["phone"],
+                "suppressed_not_found": self.suppressed
+            }
+
+# Oturum havuzu - her oturum ayrı Chrome profili ve ayrı WhatsApp numarası
+BOT_SESSIONS = int(os.environ.get("BOT_SESSIONS", "1"))
+BOT_PROFILE_ROOT = os.environ.get("BOT_PROFILE_ROOT", "chrome_profiles")
+BOT_LINKED_NUMBERS = [n.strip() for n in os.environ.get("BOT_LINKED_NUMBERS", "").split(",") if n.strip()]
+
+# Chrome profil modu - "bot": hafif profil (varsayılan), "full": eski tam Chrome ayarları
+CHROME_PROFILE_MODE = os.environ.get("CHROME_PROFILE_MODE", "bot")
+CHROME_BINARY = os.environ.get("CHROME_BINARY", "/bin/google-chrome")
+CHROME_HEADLESS = os.environ.get("CHROME_HEADLESS", "0") == "1"   # Benchmark ve CI için - gerçek oturumda QR görünmez
+CHROME_WINDOW_SIZE = os.environ.get("CHROME_WINDOW_SIZE", "1024,768")
+CHROME_MAX_HEAP_MB = int(os.environ.get("CHROME_MAX_HEAP_MB", "512"))
+
+# Bot profilinde indirilmeyen kaynaklar - medya, avatar, sticker ve fontlar
+CHROME_BLOCKED_URLS = [
+    "*mmg.whatsapp.net*",     # Medya, sticker, küçük resimler
+    "*pps.whatsapp.net*",     # Profil fotoğrafları
+    "*.mp4*", "*.webm*", "*.ogg*", "*.opus*",
+    "*.woff", "*.woff2", "*.ttf", "*.otf"
+]
+
+# Profilde kayıtlı oturum varsa sohbet listesinin gelmesi için beklenen süre
+SESSION_RESUME_TIMEOUT = float(os.environ.get("SESSION_RESUME_TIMEOUT", "20"))
+
+# QR kodunun taranması için beklenen süre - dolarsa tarayıcı yeniden kurulur
+QR_LOGIN_TIMEOUT = float(os.environ.get("QR_LOGIN_TIMEOUT", "300"))
+
+# Art arda bu kadar hata olursa oturum yeniden başlatılır
+RECONNECT_AFTER_ERRORS = int(os.environ.get("RECONNECT_AFTER_ERRORS", "3"))
+
+# Sağlık kontrolü ve otomatik kurtarma
+HEALTH_PROBE_INTERVAL = float(os.environ.get("HEALTH_PROBE_INTERVAL", "15"))   # Dinleyici içinden yoklama aralığı
+HEALTH_STALE_SECONDS = float(os.environ.get("HEALTH_STALE_SECONDS", "120"))    # Bu kadar kalp atışı yoksa takılmış sayılır
+RESTART_BACKOFF_MIN = float(os.environ.get("RESTART_BACKOFF_MIN", "5"))
+RESTART_BACKOFF_MAX = float(os.environ.get("RESTART_BACKOFF_MAX", "300"))
+
+# Sayfa sağlığını tek çağrıda yoklayan script
+HEALTH_PROBE_JS = """
+return {
+    url: location.href,
+    logged_in: !!document.querySelector('#pane-side'),
+    qr: !!document.querySelector('canvas[aria-label], div[data-ref]'),
+    compose: !!document.querySelector("footer div[contenteditable='true'], #side div[contenteditable='true'], #side input[type='text']")
+};
+"""
+
+class SessionUnhealthy(Exception):
+    """Oturum sağlıksız - dinleyici döngüsünden çıkılıp oturum yeniden başlatılır"""
+
+# Tüm oturumların paylaştığı selector çözücü
+selector_resolver = SelectorResolver()
+
+class WhatsAppBot:
+    def __init__(self, session_id="default", profile_dir=None, linked_number=None):
+        self.session_id = session_id
+        self.profile_dir = profile_dir
+        self.linked_number = linked_number
+        self.ready = False
+        self.reconnecting = False
+        self.health = {"status": "starting", "checked_at": None, "last_error": None}
+        self.restarts = 0
+        self.last_heartbeat = time.monotonic()
+        self.last_probe = 0.0
         self.driver = None
         self.last_message_count = 0
-        self.processed_messages = set()
+        self.processed_messages = DedupCache(path=self.state_path(f"processed_{session_id}.log"))
+        self.chat_cursors = ChatCursors(path=self.state_path(f"cursors_{session_id}.log"))
         self.last_chat_scan = 0
+        self.scraper_mode = SCRAPER_MODE
+        self.outbound_queue = OutboundQueue()
+        self.rate_limiter = SendRateLimiter()
+        self.step_timings = StepTimings()
+        self.chat_scheduler = ChatScheduler()
         self.setup_driver()
         
+    def state_path(self, filename):
+        """Oturumun kalıcı durum dosyası (işlenmiş mesajlar, sohbet imleçleri) - kalıcılık kapalıysa None"""
+        if not DEDUP_STATE_DIR:
+            return None
+        os.makedirs(DEDUP_STATE_DIR, exist_ok=True)
+        return os.path.join(DEDUP_STATE_DIR, filename)
+    
     def setup_driver(self):
         """Chrome driver kurulumu"""
         chrome_options = Options()
-        chrome_options.binary_location = "/bin/google-chrome"
+        chrome_options.binary_location = CHROME_BINARY
+        if CHROME_HEADLESS:
+            chrome_options.add_argument("--headless=new")
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-dev-shm-usage")
         chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
         chrome_options.add_argument("--disable-blink-features=AutomationControlled")
         chrome_options.add_argument("--disable-web-security")
         chrome_options.add_argument("--disable-features=VizDisplayCompositor")
         chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         chrome_options.add_experimental_option('useAutomationExtension', False)
         
+        if CHROME_PROFILE_MODE == "bot":
+            self.apply_bot_profile(chrome_options)
+        else:
+            chrome_options.add_argument("--window-size=1920,1080")
+        
+        # Her oturumun kendi profil klasörü - oturumlar birbirini ezmez
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            chrome_options.add_argument(f"--user-data-dir={os.path.abspath(self.profile_dir)}")
+        
         try:
             self.driver = webdriver.Chrome(options=chrome_options)
             self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-            logger.info("Chrome driver başarıyla kuruldu")
+            
+            # Medya ve font isteklerini ağ katmanında engelle
+            if CHROME_PROFILE_MODE == "bot":
+                self.driver.execute_cdp_cmd("Network.enable", {})
+                self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": CHROME_BLOCKED_URLS})
+            
+            logger.info(f"Chrome driver başarıyla kuruldu [{self.session_id}] - profil: {CHROME_PROFILE_MODE}")
         except Exception as e:
             logger.error(f"Chrome driver kurulumunda hata: {e}")
             raise
     
-    def connect_whatsapp(self):
-        """WhatsApp Web'e bağlanma - YENİ SELECTOR'LAR"""
+    def apply_bot_profile(self, chrome_options):
+        """Hafif bot profili - küçük pencere, resim/bildirim kapalı, bellek sınırı"""
+        chrome_options.add_argument(f"--window-size={CHROME_WINDOW_SIZE}")
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_argument("--no-first-run")
+        chrome_options.add_argument("--disable-extensions")
+        chrome_options.add_argument("--disable-sync")
+        chrome_options.add_argument("--disable-default-apps")
+        chrome_options.add_argument("--disable-background-networking")
+        chrome_options.add_argument("--disable-component-update")
+        chrome_options.add_argument("--renderer-process-limit=2")
+        chrome_options.add_argument(f"--js-flags=--max-old-space-size={CHROME_MAX_HEAP_MB}")
+        chrome_options.add_argument("--disk-cache-size=33554432")
+        chrome_options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+            "profile.default_content_setting_values.media_stream": 2
+        })
+    
+    def connect_whatsapp(self, reload=True):
+        """WhatsApp Web'e bağlanma - sadece sohbet listesi (#pane-side) gelince bağlı sayılır
+        
+        reload=False: sayfa yenilenmez, açık olan QR ekranında girişi bekler (oturum kapandığında)
+        """
         try:
-            logger.info("WhatsApp Web'e bağlanılıyor...")
-            self.driver.get("https://web.whatsapp.com")
+            if reload:
+                logger.info("WhatsApp Web'e bağlanılıyor...")
+                self.driver.get(WHATSAPP_URL)
+                
+                # Profilde kayıtlı oturum varsa QR beklemeden devam et
+                if self.wait_for_login(SESSION_RESUME_TIMEOUT):
+                    logger.info(f"WhatsApp oturumu profilden devam ettirildi [{self.session_id}]")
+                    return True
             
             # QR kod taranana kadar bekle
-            logger.info("QR kodunu tarayın ve WhatsApp'a giriş yapın...")
-            
-            # YENİ: ÇALIŞAN SELECTOR'LAR ile bekleme
-            try:
-                WebDriverWait(self.driver, 300).until(
-                    EC.any_of(
-                        # TEST ETTİĞİMİZ ÇALIŞAN SELECTOR'LAR
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "div[role='button']")),
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "[aria-label*='Chat']")),
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "[aria-label*='chat']")),
-                        # Eski fallback'ler
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "[data-testid='chat-list']")),
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "div[data-testid='chatlist-header']"))
-                    )
-                )
-            except:
-                # Manuel kontrol - sayfa yüklenmişse devam et
-                time.sleep(5)
-                logger.info("WhatsApp sayfası manuel olarak kontrol ediliyor...")
+            logger.info(f"QR kodunu tarayın ve WhatsApp'a giriş yapın... [{self.session_id}]")
+            if not self.wait_for_login(QR_LOGIN_TIMEOUT):
+                logger.error(f"❌ {QR_LOGIN_TIMEOUT:.0f} sn içinde giriş yapılmadı [{self.session_id}]")
+                return False
             
             logger.info("WhatsApp Web'e başarıyla bağlanıldı!")
             return True
@@ -110,66 +1688,57 @@ class WhatsAppBot:
             logger.error(f"WhatsApp bağlantısında hata: {e}")
             return False
     
+    def wait_for_login(self, timeout):
+        """Sohbet listesi görünene kadar bekle - QR sayfasındaki butonlar giriş sayılmaz"""
+        try:
+            WebDriverWait(self.driver, timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "#pane-side"))
+            )
+            return True
+        except Exception:
+            return False
+    
     def send_message(self, phone_number, message):
-        """Belirtilen numaraya mesaj gönderme - YENİ SEND BUTTON SELECTOR"""
+        """Belirtilen numaraya mesaj gönderme - süre ve sonuç metriklere yazılır"""
+        started = time.perf_counter()
+        success = self.deliver_message(phone_number, message)
+        result = "ok" if success else "fail"
+        METRIC_SEND_SECONDS.observe(time.perf_counter() - started, result)
+        METRIC_MESSAGES_SENT.inc(result)
+        return success
+    
+    def deliver_message(self, phone_number, message):
+        """Sohbeti aç, mesajı yaz ve gönder - YENİ SEND BUTTON SELECTOR"""
         try:
-            # Telefon numarasını temizle ve formatla
-            clean_phone = phone_number.replace("+", "").replace(" ", "").replace("-", "")
-            
-            # Türkiye numarası kontrolü
-            if clean_phone.startswith("90") and len(clean_phone) == 12:
-                clean_phone = clean_phone
-            elif clean_phone.startswith("0") and len(clean_phone) == 11:
-                clean_phone = "90" + clean_phone[1:]
-            elif len(clean_phone) == 10 and clean_phone.startswith("5"):
-                clean_phone = "90" + clean_phone
-            
-            logger.info(f"📞 Gönderilecek telefon: {clean_phone}")
-            
-            # Mesajı URL encode et
-            import urllib.parse
-            encoded_message = urllib.parse.quote(message)
-            
-            # WhatsApp direkt mesaj URL'si
-            url = f"https://web.whatsapp.com/send?phone={clean_phone}&text={encoded_message}"
-            logger.info(f"🌐 WhatsApp URL: {url}")
-            
-            self.driver.get(url)
-            time.sleep(3)  # Sayfa yüklenmesi için bekle
-            
-            # YENİ SEND BUTTON SELECTOR'LAR - Test ettiğimiz çalışan olanlar
-            send_selectors = [
-                "span[aria-label='Send']",  # YENİ - Test kodunda çalışan
-                "button[aria-label='Send']",
-                "[data-testid='compose-btn-send']",  # ESKİ fallback
-                "span[data-icon='send']",
-                "button[data-testid='send']",
-                "span[data-icon='send']",
-                "div[role='button'][aria-label='Send']"
-            ]
-            
-            send_button = None
-            for selector in send_selectors:
-                try:
-                    logger.info(f"🔍 Send button aranıyor: {selector}")
-                    WebDriverWait(self.driver, 10).until(
-                        EC.element_to_be_clickable((By.CSS_SELECTOR, selector))
-                    )
-                    send_button = self.driver.find_element(By.CSS_SELECTOR, selector)
-                    logger.info(f"✅ Send button bulundu: {selector}")
-                    break
-                except Exception as e:
-                    logger.warning(f"❌ Send button bulunamadı: {selector} - {e}")
-                    continue
+            # WhatsApp adresleri + olmadan ülke kodlu numara ister
+            clean_phone = canonical_phone(phone_number).lstrip("+")
+            
+            logger.debug("📞 Gönderilecek telefon: %s", clean_phone)
+            
+            # Sohbeti sayfayı yenilemeden aç
+            compose_box = self.open_chat(clean_phone)
+            if not compose_box:
+                logger.error(f"❌ Sohbet açılamadı: {clean_phone}")
+                return False
+            
+            self.type_message(compose_box, message)
+            
+            # Tüm send button selector'ları tek sorguda, en son çalışan önce
+            send_button = self.wait_until(
+                "send_button", lambda d: selector_resolver.find(d, "send_button", clickable=True) or False
+            )
             
             if send_button:
+                outgoing_before = len(self.driver.find_elements(By.CSS_SELECTOR, "#main .message-out"))
                 send_button.click()
-                logger.info(f"✅ Mesaj gönderildi: {phone_number}")
-                time.sleep(3)
                 
-                # Ana sayfaya geri dön
-                self.driver.get("https://web.whatsapp.com")
-                time.sleep(2)
+                # Tik çizilene kadar bekle - mesaj sunucuya ulaştı
+                if self.wait_until(
+                    "message_tick", lambda d: d.execute_script(OUTGOING_TICK_JS, outgoing_before)
+                ):
+                    logger.info(f"✅ Mesaj gönderildi: {phone_number}")
+                else:
+                    logger.warning(f"⚠️ Mesaj gönderildi, tik görülmedi: {phone_number}")
                 return True
             else:
                 logger.error("❌ Send button bulunamadı! Tüm selector'lar denendi.")
@@ -179,379 +1748,733 @@ class WhatsAppBot:
             logger.error(f"❌ Mesaj gönderiminde hata: {e}")
             return False
     
+    def open_chat(self, clean_phone):
+        """Sohbeti uygulama içinden aç, mesaj kutusunu döndür - sadece telefonu doğrulanan sohbete yazılır"""
+        # Sayfada açık olan sohbet zaten bu numaraysa hiçbir yere gitme
+        if self.chat_matches_phone(clean_phone):
+            compose_box = self.wait_for_compose_box(timeout=2)
+            if compose_box:
+                return compose_box
+        
+        # 1. Arama kutusu ve sohbet listesi - sayfa yeniden yüklenmez
+        try:
+            compose_box = self.open_chat_from_search(clean_phone)
+            if compose_box:
+                logger.debug("💬 Sohbet aramadan açıldı: %s", clean_phone)
+                return compose_box
+        except Exception as e:
+            logger.warning(f"Aramadan sohbet açılamadı: {e}")
+        
+        # 2. Son çare: send?phone= adresini yükle (tam sayfa yüklemesi)
+        logger.info("🌐 send?phone= adresi yükleniyor (fallback)")
+        self.driver.get(f"{WHATSAPP_URL}/send?phone={clean_phone}")
+        compose_box = self.wait_for_compose_box(step="compose_box_fallback")
+        if compose_box and not self.wait_until(
+            "chat_phone", lambda d: self.chat_matches_phone(clean_phone, trust_url=True)
+        ):
+            logger.error(f"❌ Açılan sohbet {clean_phone} değil")
+            return None
+        return compose_box
+    
+    def open_chat_from_search(self, clean_phone):
+        """Numarayı arama kutusuna yaz, başlığı bu numara olan satırı aç - doğrulanmış mesaj kutusunu döndür"""
+        search_box = selector_resolver.find(self.driver, "search_box", clickable=True)
+        if not search_box:
+            return None
+        
+        old_main = self.driver.find_elements(By.CSS_SELECTOR, "#main")
+        self.clear_search(search_box)
+        search_box.send_keys(clean_phone)
+        try:
+            # Kayıtlı isimle görünen sohbetler burada bulunmaz - send?phone= ile açılır
+            row = self.wait_until("chat_search", lambda d: d.execute_script(FIND_PHONE_ROW_JS, clean_phone))
+            if not row:
+                return None
+            row.click()
+            
+            # Önceki sohbetin paneli kaldırılmadıysa sohbet değişmedi
+            if old_main and not self.wait_until("chat_switch", EC.staleness_of(old_main[0])):
+                logger.warning(f"⚠️ Sohbet değişmedi: {clean_phone}")
+                return None
+        finally:
+            self.clear_search(search_box)
+        
+        # Başlık ve mesajlar yeni sohbete geçene kadar bekle
+        if not self.wait_until("chat_phone", lambda d: self.chat_matches_phone(clean_phone)):
+            logger.warning(f"⚠️ Açılan sohbet {clean_phone} değil")
+            return None
+        return self.wait_for_compose_box()
+    
+    def clear_search(self, search_box):
+        """Arama kutusunu boşalt - sohbet listesi eski haline döner"""
+        search_box.send_keys(Keys.CONTROL, "a")
+        search_box.send_keys(Keys.BACKSPACE)
+    
+    def chat_matches_phone(self, clean_phone, trust_url=False):
+        """Açık sohbetin telefonu (JID ya da başlık) verilen numara mı"""
+        result = self.driver.execute_script(CHAT_PHONE_JS, selector_resolver.ordered("chat_header")) or {}
+        if result.get("phone"):
+            return canonical_phone(result["phone"]).lstrip("+") == clean_phone
+        
+        # Telefonu okunamayan sohbete sadece send?phone= yüklemesinden hemen sonra adresle güvenilir
+        if trust_url:
+            phone_match = URL_PHONE_RE.search(self.driver.current_url)
+            return bool(phone_match) and phone_match.group(1) == clean_phone
+        return False
+    
+    def wait_for_compose_box(self, step="compose_box", timeout=None):
+        """Mesaj yazma kutusu hazır olana kadar bekle"""
+        return self.wait_until(
+            step,
+            lambda d: selector_resolver.find(d, "compose_box", clickable=True) or False,
+            timeout
+        )
+    
+    def wait_until(self, step, condition, timeout=None):
+        """Koşul sağlanana kadar bekle ve süresini kaydet - zaman aşımında None"""
+        if timeout is None:
+            timeout = WAIT_TIMEOUTS[step]
+        
+        # Yavaş ama ilerleyen dinleyici takılmış sayılmasın - kalp atışı her beklemede yenilenir
+        started = self.last_heartbeat = time.monotonic()
+        try:
+            result = WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(condition)
+        except Exception:
+            result = None
+        self.last_heartbeat = time.monotonic()
+        self.step_timings.record(step, self.last_heartbeat - started, result is None)
+        return result
+    
+    def type_message(self, compose_box, message):
+        """Mesajı satır satır yaz - satır sonları Shift+Enter ile"""
+        lines = message.split("\n")
+        for i, line in enumerate(lines):
+            if line:
+                self.driver.execute_script(INSERT_TEXT_JS, compose_box, line)
+            if i < len(lines) - 1:
+                compose_box.send_keys(Keys.SHIFT, Keys.ENTER)
+    
     def listen_messages(self):
-        """WhatsApp mesajlarını dinleme - YENİ ÇALIŞAN SELECTOR'LAR"""
-        global whatsapp_ready
-        whatsapp_ready = True
-        logger.info("🚀 WhatsApp mesaj dinleme başlatıldı - YENİ SELECTOR'LAR")
+        """WhatsApp mesajlarını dinleme - SAYFA İÇİ GÖZLEMCİ, oturum sağlıksızsa SessionUnhealthy fırlatır"""
+        self.ready = True
+        logger.info(f"🚀 WhatsApp mesaj dinleme başlatıldı - MutationObserver [{self.session_id}]")
         
+        consecutive_errors = 0
         while True:
             try:
+                self.last_heartbeat = time.monotonic()
+                
+                # Periyodik sağlık yoklaması
+                if self.last_heartbeat - self.last_probe >= HEALTH_PROBE_INTERVAL:
+                    self.check_health()
+                
                 # Ana sayfa kontrolü
+                # Sadece WhatsApp dışına çıkıldıysa yeniden yükle
                 current_url = self.driver.current_url
-                if 'web.whatsapp.com' not in current_url or 'send' in current_url:
+                if not current_url.startswith(WHATSAPP_URL):
                     logger.info("🔄 Ana sayfaya dönülüyor...")
-                    self.driver.get("https://web.whatsapp.com")
-                    time.sleep(3)
+                    self.driver.get(WHATSAPP_URL)
+                    self.wait_until("chat_list", EC.presence_of_element_located((By.CSS_SELECTOR, "#pane-side")))
                 
-                # YENİ: TEST ETTİĞİMİZ ÇALIŞAN SELECTOR'LAR
-                chat_selectors = [
-                    "div[role='button'][aria-label]",  # Test: 4 element bulmuştu
-                    "div[role='button']",              # Test: 4 element bulmuştu  
-                    "[aria-label*='Chat']",            # Test: 1 element bulmuştu
-                    "[aria-label*='chat']"             # Test: 2 element bulmuştu
-                ]
+                sweep_started = time.perf_counter()
                 
-                all_chats = []
-                for selector in chat_selectors:
-                    chats = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                    if chats:
-                        all_chats = chats
-                        logger.info(f"✅ {len(chats)} sohbet bulundu (selector: {selector})")
-                        break
+                # Bekleyen gönderimler önce
+                self.process_outbound_jobs(SEND_BUDGET_PER_CYCLE)
                 
-                # Fallback: ESKİ SELECTOR'LAR
-                if not all_chats:
-                    all_chats = self.driver.find_elements(By.CSS_SELECTOR, 
-                        "div[data-testid='chat-list'] div[data-testid='cell-frame-container']"
-                    )
-                    logger.info(f"📋 Fallback: {len(all_chats)} sohbet (eski selector)")
+                events = self.drain_inbound_events()
                 
-                logger.info(f"🔍 Toplam {len(all_chats)} sohbet bulundu")
-                
-                # İlk 5 sohbeti kontrol et (daha hızlı)
-                for i, chat in enumerate(all_chats[:5]):
-                    try:
-                        logger.info(f"📱 Sohbet {i+1} kontrol ediliyor...")
-                        
-                        # Sohbete tıkla
-                        chat.click()
-                        time.sleep(2)
-                        
-                        # Telefon numarasını al - URL'den (en güvenilir)
-                        phone = self.extract_phone_from_current_chat()
-                        logger.info(f"📞 Telefon: {phone}")
-                        
-                        # Bu sohbetteki yeni mesajları kontrol et
-                        if phone:
-                            self.check_new_messages_in_chat(phone)
-                        
-                        # Ana listeye geri dön
-                        self.driver.get("https://web.whatsapp.com")
-                        time.sleep(1)
-                        
-                    except Exception as e:
-                        logger.error(f"Sohbet {i+1} işlemede hata: {e}")
-                        # Ana sayfaya dön
-                        self.driver.get("https://web.whatsapp.com")
-                        time.sleep(1)
-                        continue
+                # Sohbet listesi yok (sayfa yükleniyor) - gözlemci kurulamaz, liste gelene kadar tur atlanır
+                if events is None:
+                    logger.debug("⏳ Sohbet listesi bekleniyor")
+                    self.wait_until("chat_list", EC.presence_of_element_located((By.CSS_SELECTOR, "#pane-side")))
+                    visited = 0
+                else:
+                    if events:
+                        self.handle_inbound_events(events)
+                    # Önceki turlardan kalan sohbetler olay gelmese de açılır
+                    visited = self.visit_pending_chats()
+                METRIC_SWEEP_SECONDS.observe(time.perf_counter() - sweep_started, self.session_id)
                 
-                logger.info("💤 5 saniye bekleniyor...")
-                time.sleep(5)
+                # İş varken sık, boştayken seyrek yokla - yeni gönderim gelirse beklemeyi kes
+                interval = self.chat_scheduler.next_interval(bool(events) or visited > 0)
+                logger.debug("💤 %.2f saniye bekleniyor...", interval)
+                self.outbound_queue.wait_for_job(interval)
+                consecutive_errors = 0
                 
+            except SessionUnhealthy:
+                # run() karar verir - oturum kapandıysa QR beklenir, değilse tarayıcı yeniden kurulur
+                raise
             except Exception as e:
-                logger.error(f"Ana mesaj dinleme hatası: {e}")
+                logger.error(f"Ana mesaj dinleme hatası [{self.session_id}]: {e}")
+                self.health["last_error"] = str(e)
+                consecutive_errors += 1
+                if consecutive_errors >= RECONNECT_AFTER_ERRORS:
+                    return
                 time.sleep(10)
     
-    def check_new_messages_in_chat(self, phone):
-        """Mevcut sohbetteki yeni mesajları kontrol et - BASİTLEŞTİRİLMİŞ"""
+    def probe_health(self):
+        """Sayfa canlı mı, giriş yapılmış mı, mesaj/arama kutusu erişilebilir mi"""
         try:
-            # Sayfanın yüklenmesini bekle
-            time.sleep(2)
+            result = self.driver.execute_script(HEALTH_PROBE_JS) or {}
+        except Exception as e:
+            return {"status": "page_dead", "healthy": False, "error": str(e)}
+        
+        if not result.get("logged_in"):
+            status = "logged_out" if result.get("qr") else "not_loaded"
+        elif not result.get("compose"):
+            status = "compose_unreachable"
+        else:
+            status = "healthy"
+        return {"status": status, "healthy": status == "healthy"}
+    
+    def check_health(self):
+        """Sağlığı yokla ve kaydet - sağlıksızsa SessionUnhealthy fırlat"""
+        probe = self.probe_health()
+        self.last_probe = time.monotonic()
+        self.health["status"] = probe["status"]
+        self.health["checked_at"] = datetime.now().isoformat()
+        if not probe["healthy"]:
+            self.health["last_error"] = probe.get("error") or probe["status"]
+            raise SessionUnhealthy(probe["status"])
+        return probe
+    
+    def run(self):
+        """Oturum thread'i - bağlan, dinle; oturum bozulursa geri çekilerek yeniden başlat"""
+        backoff = RESTART_BACKOFF_MIN
+        reload = True
+        while True:
+            try:
+                if self.driver is None:
+                    self.setup_driver()
+                    reload = True
+                
+                if self.connect_whatsapp(reload):
+                    self.check_health()
+                    backoff = RESTART_BACKOFF_MIN
+                    self.reconnecting = False
+                    self.listen_messages()
+                else:
+                    logger.error(f"❌ WhatsApp bağlantısı kurulamadı! [{self.session_id}]")
+            except SessionUnhealthy as e:
+                logger.error(f"🩺 Oturum sağlıksız [{self.session_id}]: {e}")
+                
+                # Oturum kapandı - Chrome kapatılmaz, aynı sayfadaki QR ile yeniden giriş beklenir
+                if str(e) == "logged_out":
+                    self.ready = False
+                    self.reconnecting = True
+                    reload = False
+                    continue
+            except Exception as e:
+                logger.error(f"❌ Oturum hatası [{self.session_id}]: {e}")
+                self.health["last_error"] = str(e)
             
-            # BASİT YAKLAŞIM: Tüm span ve div elementlerindeki metinleri tara
-            all_text_elements = self.driver.find_elements(By.CSS_SELECTOR, "span, div")
+            # Oturumu rotasyondan çıkar ve tarayıcıyı baştan kur
+            self.ready = False
+            self.reconnecting = True
+            self.health["status"] = "restarting"
+            self.restart_driver()
+            logger.warning(f"🔌 Oturum {backoff:.0f} sn sonra yeniden başlatılacak: {self.session_id}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+    
+    def restart_driver(self):
+        """Chrome'u kapat - bir sonraki run turunda yeniden kurulur"""
+        self.restarts += 1
+        driver, self.driver = self.driver, None
+        if driver:
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.warning(f"Driver kapatma hatası [{self.session_id}]: {e}")
+    
+    def is_stalled(self):
+        """Dinleyici uzun süredir kalp atışı göndermiyor mu (tarayıcı çağrısında takılmış)"""
+        return self.ready and time.monotonic() - self.last_heartbeat > HEALTH_STALE_SECONDS
+    
+    def is_available(self):
+        """Oturum gönderim için kullanılabilir mi"""
+        return self.ready and not self.reconnecting and self.health["status"] == "healthy"
+    
+    def stats(self):
+        """Oturum durumu"""
+        return {
+            "session_id": self.session_id,
+            "linked_number": self.linked_number,
+            "ready": self.ready,
+            "reconnecting": self.reconnecting,
+            "available": self.is_available(),
+            "health": dict(self.health, restarts=self.restarts),
+            "heartbeat_age_seconds": round(time.monotonic() - self.last_heartbeat, 1),
+            "outbound_queue": self.outbound_queue.stats(),
+            "rate_limiter": self.rate_limiter.stats(),
+            "chat_scheduler": self.chat_scheduler.stats(),
+            "wait_timings": self.step_timings.stats()
+        }
+    
+    def process_outbound_jobs(self, budget):
+        """Gönderim kuyruğundan en fazla budget iş gönder - tarayıcıyı kullanan tek yer"""
+        for _ in range(budget):
+            self.last_heartbeat = time.monotonic()
+            job = self.outbound_queue.get_nowait()
+            if job is None:
+                return
             
-            logger.info(f"🔍 {len(all_text_elements)} metin elementi taranıyor...")
+            # Hız sınırı - iş düşürülmez, token dolunca gönderilmek üzere ertelenir
+            delay, scope = self.rate_limiter.reserve(job["phone"])
+            if delay > 0:
+                self.outbound_queue.requeue(job, not_before=time.time() + delay)
+                logger.debug("⏳ Gönderim %.1f sn ertelendi (%s sınırı): %s", delay, scope, job["phone"])
+                if scope == "session":
+                    # Oturum kovası boş - token dolana kadar kuyruktan başka iş alınmaz
+                    self.outbound_queue.pause(time.time() + delay)
+                    return
+                continue
             
-            # Son 50 elementi kontrol et (yeni mesajlar sonda olur)
-            recent_elements = all_text_elements[-50:]
+            success = self.send_message(job["phone"], job["message"])
             
-            for element in recent_elements:
-                try:
-                    text = element.text.strip().lower()
-                    
-                    # Mesaj benzeri metin mi?
-                    if text and len(text) > 3 and len(text) < 100:
-                        # Timestamp kontrolü - yeni mesajları bul
-                        current_time = int(time.time())
-                        msg_id = f"{phone}_{text}_{current_time // 60}"  # 1 dakika grupları
-                        
-                        if msg_id not in self.processed_messages:
-                            self.processed_messages.add(msg_id)
-                            
-                            # Memory temizliği
-                            if len(self.processed_messages) > 500:
-                                self.processed_messages = set(list(self.processed_messages)[-250:])
-                            
-                            logger.info(f"📨 YENİ METİN BULUNDU: '{text}' - {phone}")
-                            
-                            # OTP talebi mi kontrol et
-                            if any(keyword in text for keyword in ["oluşturma", "düzenleme", "kod", "otp"]):
-                                logger.info(f"🎯 OTP TALEBİ ALGILANDI: '{text}'")
-                                self.process_message(phone, text)
-                            
-                except Exception as element_error:
-                    continue
-                    
+            # Gönderim oturum bozulduğu için başarısızsa iş kaybolmaz, yeniden başlatmadan sonra tekrar denenir
+            if not success and not self.probe_health()["healthy"]:
+                self.outbound_queue.requeue(job)
+                logger.warning(f"↩️ Gönderim yeniden kuyruğa alındı: {job['phone']} - {job['tur']}")
+                self.check_health()
+            
+            self.outbound_queue.mark_done(job, success)
+            
+            if success:
+                logger.info(f"✅ CEVAP GÖNDERİLDİ: {job['phone']} - {job['tur']}")
+            else:
+                logger.error(f"❌ CEVAP GÖNDERİLEMEDİ: {job['phone']} - {job['tur']}")
+    
+    def drain_inbound_events(self):
+        """Gözlemciyi kur (gerekirse) ve biriken olayları tek çağrıda al"""
+        result = self.driver.execute_script(INBOUND_OBSERVER_JS)
+        if not result or not result.get("installed"):
+            return None
+        return result.get("events") or []
+    
+    def handle_inbound_events(self, events):
+        """Gözlemci olaylarını işle - okunmamış sohbetler sıraya girer, açık sohbetin mesajları hemen işlenir"""
+        records_by_chat = {}
+        
+        for event in events:
+            if event.get("type") == "unread":
+                self.chat_scheduler.add(event["chat"], event.get("ts"))
+            elif event.get("type") == "message":
+                records_by_chat.setdefault(event.get("chat"), []).append(event)
+        
+        # Açık sohbete gelen mesajlar - bir turda birden fazla sohbetten olabilir, her biri kendi telefonuyla
+        for chat, records in records_by_chat.items():
+            phone = self.phone_for_records(chat, records)
+            if not phone:
+                # Telefon çözülemedi - sohbet ziyarette okunsun
+                if chat:
+                    self.chat_scheduler.add(chat, records[0].get("ts"))
+                continue
+            
+            for record in records:
+                record["direction"] = "in"
+                self.handle_inbound_record(phone, record)
+            self.chat_cursors.set(phone, records[-1]["id"])
+    
+    def phone_for_records(self, chat, records):
+        """Gözlemci kayıtlarının telefonu - önce mesaj kimliğindeki JID, sohbet hâlâ açıksa sayfadan"""
+        for record in records:
+            match = MESSAGE_JID_RE.match(record.get("id") or "")
+            if match:
+                return canonical_phone(match.group(1))
+        
+        # JID yok - sadece sohbet şu an açıksa sayfadaki telefon bu sohbetindir
+        if chat and self.driver.execute_script(CHAT_HEADER_MATCHES_JS, chat):
+            return self.extract_phone_from_current_chat(chat)
+        return None
+    
+    def visit_pending_chats(self):
+        """Sıradaki okunmamış sohbetleri en eski bekleyen önce aç - açılan sohbet sayısını döndürür"""
+        chats = self.chat_scheduler.next_chats()
+        for chat in chats:
+            # Sohbet ziyaretleri arasında bekleyen bir gönderimi işle
+            self.process_outbound_jobs(1)
+            
+            # Sohbet sadece başarılı ziyaretten sonra sıradan çıkar
+            if self.visit_chat(chat, self.chat_scheduler.seen_at(chat)):
+                self.chat_scheduler.done(chat)
+            elif not self.chat_scheduler.failed(chat):
+                logger.warning(f"⚠️ Sohbet {self.chat_scheduler.retries} denemede açılamadı, sıradan çıkarıldı: {chat}")
+        return len(chats)
+    
+    def visit_chat(self, chat, seen_at=None):
+        """Okunmamış sohbeti aç ve yeni mesajları işle - başarılıysa True"""
+        try:
+            logger.debug("📱 Okunmamış mesaj: %s", chat)
+            row = self.driver.execute_script(FIND_CHAT_ROW_JS, chat)
+            if not row:
+                logger.warning(f"⚠️ Sohbet satırı bulunamadı: {chat}")
+                return False
+            
+            row.click()
+            
+            # Başlık tıklanan sohbete geçene kadar bekle
+            if not self.wait_until(
+                "chat_header", lambda d: d.execute_script(CHAT_HEADER_MATCHES_JS, chat)
+            ):
+                logger.warning(f"⚠️ Sohbet açılmadı: {chat}")
+                return False
+            
+            phone = self.extract_phone_from_current_chat(chat)
+            logger.debug("📞 Telefon: %s", phone)
+            if not phone:
+                return False
+            
+            self.check_new_messages_in_chat(phone, seen_at)
+            return True
+                
         except Exception as e:
-            logger.error(f"Mesaj kontrol hatası: {e}")
+            logger.error(f"Sohbet işlemede hata ({chat}): {e}")
+            return False
     
-    def extract_phone_from_current_chat(self):
-        """Mevcut sohbetten telefon numarasını çıkarma - URL ÖNCELİKLİ"""
+    def check_new_messages_in_chat(self, phone, seen_at=None):
+        """Mevcut sohbetteki yeni mesajları kontrol et - TEK SCRIPT ÇAĞRISI"""
         try:
-            # 1. URL'den telefon numarasını al (EN GÜVENİLİR)
-            current_url = self.driver.current_url
-            logger.info(f"🔗 Mevcut URL: {current_url}")
+            # Mesaj balonları yüklenene kadar bekle (boş sohbette zaman aşımı normal)
+            self.wait_until(
+                "messages_loaded", EC.presence_of_element_located((By.CSS_SELECTOR, "#main div[data-id]"))
+            )
             
-            if 'phone=' in current_url:
-                phone_match = re.search(r'phone=(\d+)', current_url)
-                if phone_match:
-                    phone = '+' + phone_match.group(1)
-                    logger.info(f"🎯 URL'den telefon: {phone}")
-                    return phone
+            # Eski element taraması sadece açıkça seçildiğinde
+            if self.scraper_mode == "legacy":
+                self.check_new_messages_legacy(phone)
+                return
+            
+            cursor_key = canonical_phone(phone)
+            records = self.scrape_chat_messages(cursor=self.chat_cursors.get(cursor_key))
+            if records is None:
+                logger.warning(f"⚠️ Açık sohbet okunamadı: {phone}")
+                return
             
-            # 2. Sayfa başlığından al (FALLBACK)
+            logger.debug("🔍 %d yeni mesaj balonu okundu (tek çağrı)", len(records))
+            
+            for record in records:
+                # Okunmamış rozetinin görüldüğü an algılama gecikmesinin başlangıcı
+                if seen_at and "ts" not in record:
+                    record["ts"] = seen_at
+                self.handle_inbound_record(phone, record)
+            
+            # Sonraki ziyarette sadece bu balondan sonrakiler okunur
+            if records:
+                self.chat_cursors.set(cursor_key, records[-1]["id"])
+                    
+        except Exception as e:
+            logger.error(f"Mesaj kontrol hatası: {e}")
+    
+    def handle_inbound_record(self, phone, record):
+        """Tek bir mesaj kaydını işle (scraper veya gözlemciden)"""
+        # Sadece karşı taraftan gelen mesajlar
+        if record.get("direction") != "in":
+            return
+        
+        text = (record.get("text") or "").strip().lower()
+        if not text:
+            return
+        
+        # WhatsApp mesaj kimliği kalıcıdır - aynı mesaj bir daha cevaplanmaz
+        msg_id = f"{canonical_phone(phone)}_{record['id']}"
+        if not self.processed_messages.add(msg_id):
+            return
+        
+        logger.debug("📨 YENİ MESAJ: '%s' - %s (%s)", text, phone, record.get("timestamp"))
+        
+        # OTP talebi mi kontrol et - niyet ve tür tek geçişte
+        intent, tur = classify_message(text)
+        if intent == "otp":
+            logger.info(f"🎯 OTP TALEBİ ALGILANDI: '{text}'")
+            if record.get("ts"):
+                METRIC_DETECTION_LAG_SECONDS.observe(max(0.0, time.time() - record["ts"] / 1000))
+            self.process_message(phone, tur)
+    
+    def scrape_chat_messages(self, limit=50, cursor=None):
+        """Açık sohbetteki imleçten yeni mesaj balonlarını tek execute_script ile oku"""
+        try:
+            result = self.driver.execute_script(MESSAGE_SCRAPER_JS, limit, cursor)
+        except Exception as e:
+            logger.warning(f"Mesaj scripti çalışmadı: {e}")
+            return None
+        
+        # Sohbet paneli yoksa None - balon yoksa (boş sohbet) boş liste
+        if not result:
+            return None
+        if not result.get("total"):
+            logger.debug("📭 Açık sohbette mesaj balonu yok")
+        return result["records"]
+    
+    def check_new_messages_legacy(self, phone):
+        """Eski yöntem - mesaj balonlarını (yoksa tüm span/div elementlerini) tek tek tara"""
+        # Önce sadece gelen mesaj balonları - arayüz metinleri sınıflandırılmaz
+        all_text_elements = self.driver.find_elements(By.CSS_SELECTOR, "#main .message-in span.selectable-text")
+        if not all_text_elements:
+            # BASİT YAKLAŞIM: Tüm span ve div elementlerindeki metinleri tara
+            all_text_elements = self.driver.find_elements(By.CSS_SELECTOR, "span, div")
+        
+        logger.debug("🔍 %d metin elementi taranıyor...", len(all_text_elements))
+        
+        # Son 50 elementi kontrol et (yeni mesajlar sonda olur)
+        recent_elements = all_text_elements[-50:]
+        
+        for element in recent_elements:
             try:
-                # Yeni WhatsApp için farklı selector'lar
-                title_selectors = [
-                    "header span",
-                    "h1", "h2", "h3",
-                    "[data-testid='conversation-header'] span",
-                    "span[title]",
-                    "div[data-testid='conversation-header'] span",
-                    "header div span"
-                ]
+                text = element.text.strip().lower()
                 
-                for selector in title_selectors:
-                    title_elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                    logger.info(f"🔍 {selector} selector'ında {len(title_elements)} element bulundu")
+                # Mesaj benzeri metin mi?
+                if text and len(text) > 3 and len(text) < 100:
+                    # Element metninin kalıcı kimliği yok - 1 dakikalık gruplar kullanılır
+                    current_time = int(time.time())
+                    msg_id = f"{phone}_{text}_{current_time // 60}"  # 1 dakika grupları
                     
-                    for element in title_elements:
-                        text = element.text.strip()
-                        logger.info(f"📋 Element metni: '{text}'")
+                    if self.processed_messages.add(msg_id):
+                        logger.debug("📨 YENİ METİN BULUNDU: '%s' - %s", text, phone)
                         
-                        # Telefon formatını kontrol et
-                        if re.search(r'\+?\d{10,15}', text):
-                            clean_number = re.sub(r'[^\d+]', '', text)
-                            if len(clean_number) >= 10:
-                                if not clean_number.startswith('+'):
-                                    clean_number = '+' + clean_number
-                                logger.info(f"📋 Başlıktan telefon: {clean_number}")
-                                return clean_number
-                                
-            except Exception as header_error:
-                logger.warning(f"Başlık okuma hatası: {header_error}")
-            
-            # 3. Son çare: Sayfadaki tüm metinleri tara
-            try:
-                all_texts = self.driver.find_elements(By.CSS_SELECTOR, "*")
-                for element in all_texts:
-                    try:
-                        text = element.text.strip()
-                        if re.search(r'\+?\d{10,15}', text):
-                            clean_number = re.sub(r'[^\d+]', '', text)
-                            if len(clean_number) >= 10:
-                                if not clean_number.startswith('+'):
-                                    clean_number = '+' + clean_number
-                                logger.info(f"🔍 Genel taramadan telefon: {clean_number}")
-                                return clean_number
-                    except:
-                        continue
-            except Exception as scan_error:
-                logger.warning(f"Genel tarama hatası: {scan_error}")
-            
-            logger.warning("❌ Telefon numarası bulunamadı")
-            return None
+                        # OTP talebi mi kontrol et
+                        intent, tur = classify_message(text)
+                        if intent == "otp":
+                            logger.info(f"🎯 OTP TALEBİ ALGILANDI: '{text}'")
+                            self.process_message(phone, tur)
+                        
+            except Exception as element_error:
+                continue
+    
+    def extract_phone_from_current_chat(self, chat=None):
+        """Mevcut sohbetten telefon numarasını çıkarma - numara başlık, sonra tek script çağrısı"""
+        # Başlığın kendisi numaraysa sayfayı okumaya gerek yok
+        # İsimli başlıklar önbelleğe alınmaz - aynı isim farklı kişilerde olabilir, her seferinde JID okunur
+        if chat and TITLE_PHONE_RE.match(chat):
+            phone = canonical_phone(chat)
+            if len(phone) >= 11:
+                return phone
+        
+        try:
+            result = self.driver.execute_script(
+                CHAT_PHONE_JS, selector_resolver.ordered("chat_header")
+            ) or {}
+            
+            phone = None
+            if result.get("phone"):
+                phone = canonical_phone(result["phone"])
+                if len(phone) < 11:
+                    phone = None
+            
+            # Son çare: send?phone= ile açılmış sohbetlerde URL
+            if not phone:
+                phone_match = URL_PHONE_RE.search(self.driver.current_url)
+                if phone_match:
+                    phone = canonical_phone(phone_match.group(1))
+                    result["source"] = "url"
+            
+            if not phone:
+                logger.warning(f"❌ Telefon numarası bulunamadı ({result.get('chat')})")
+                return None
+            
+            logger.debug("🎯 Telefon (%s): %s", result.get("source"), phone)
+            if result.get("selector"):
+                selector_resolver.record_success("chat_header", result["selector"])
+            return phone
             
         except Exception as e:
             logger.error(f"Telefon çıkarma hatası: {e}")
             return None
     
-    def process_message(self, phone, message):
-        """Gelen mesajı işleme - BASİTLEŞTİRİLMİŞ"""
+    def process_message(self, phone, tur):
+        """Sınıflandırılmış OTP talebini işleme - tür classify_message'dan gelir"""
         try:
             if not phone:
                 logger.warning("⚠️ Telefon numarası yok")
                 return
-                
-            message = message.strip().lower()
-            logger.info(f"🔄 MESAJ İŞLENİYOR: '{message}' - {phone}")
-            
-            # Tür belirleme
-            if "oluşturma" in message:
-                tur = "oluşturma"
-            elif "düzenleme" in message:
-                tur = "düzenleme"
-            else:
-                tur = "oluşturma"  # Default
             
             logger.info(f"🎯 OTP TALEBİ: {tur} - {phone}")
             
             # OTP'yi bul ve gönder
             otp_code = self.get_otp_from_pool(phone, tur)
             
+            # Cevaplar gönderim kuyruğuna - dinleme döngüsü bloklanmaz
             if otp_code:
-                response_message = f"🔐 OTP Kodunuz: {otp_code}\n\nBu kod 5 dakika geçerlidir."
-                if self.send_message(phone, response_message):
-                    logger.info(f"✅ OTP GÖNDERİLDİ: {phone} - {tur} - {otp_code}")
+                response_message = OTP_REPLY_TEMPLATE.format(otp=otp_code)
+                if self.outbound_queue.put(phone, tur, response_message):
+                    logger.info(f"📤 OTP KUYRUĞA ALINDI: {phone} - {tur} - {mask_otp(otp_code)}")
                 else:
-                    logger.error(f"❌ OTP GÖNDERİLEMEDİ: {phone}")
+                    logger.info(f"🔁 OTP cevabı birleştirildi: {phone} - {tur}")
             else:
-                error_message = "❌ Geçerli bir OTP kodu bulunamadı.\n\nLütfen önce işleminizi başlatın."
-                self.send_message(phone, error_message)
-                logger.warning(f"⚠️ OTP BULUNAMADI: {phone} - {tur}")
+                # Tekrar tekrar "kod" yazan müşteriye her seferinde hata cevabı gönderilmez
+                if self.rate_limiter.allow_not_found_reply(phone):
+                    error_message = "❌ Geçerli bir OTP kodu bulunamadı.\n\nLütfen önce işleminizi başlatın."
+                    self.outbound_queue.put(phone, tur, error_message, kind="not_found")
+                    logger.warning(f"⚠️ OTP BULUNAMADI: {phone} - {tur}")
+                else:
+                    logger.info(f"🔇 Tekrar 'OTP bulunamadı' cevabı bastırıldı: {phone} - {tur}")
                         
         except Exception as e:
             logger.error(f"Mesaj işleme hatası: {e}")
     
     def get_otp_from_pool(self, phone, tur):
-        """OTP havuzundan kod alma - TELEFon VARIANT DESTEĞİ"""
-        with otp_lock:
-            # Telefon numarası formatlarını üret
-            possible_phones = self.generate_phone_variants(phone)
-            
-            logger.info(f"🔍 ARANACAK FORMATLAR: {possible_phones}")
-            logger.info(f"📋 HAVUZDAKI ANAHTARLAR: {list(otp_pool.keys())}")
-            
-            for test_phone in possible_phones:
-                key = (test_phone, tur)
-                if key in otp_pool:
-                    otp_data = otp_pool[key]
-                    # Süre kontrolü
-                    if datetime.now() - otp_data["timestamp"] < timedelta(minutes=5):
-                        # OTP'yi kullan ve sil
-                        otp_code = otp_data["otp"]
-                        del otp_pool[key]
-                        logger.info(f"✅ OTP BULUNDU: {key}")
-                        return otp_code
-                    else:
-                        # Süresi dolmuş, sil
-                        del otp_pool[key]
-                        logger.info(f"⏰ SÜRESİ DOLMUŞ: {key}")
-            
-            return None
+        """OTP havuzundan kod alma - canonical telefonla tek sorgu"""
+        started = time.perf_counter()
+        otp_code = otp_pool.take(phone, tur)
+        METRIC_LOOKUP_SECONDS.observe(time.perf_counter() - started)
+        if otp_code:
+            logger.debug("✅ OTP BULUNDU: %s - %s", canonical_phone(phone), tur)
+        return otp_code
+
+class SessionPool:
+    """WhatsAppBot oturumları havuzu - alıcıları oturumlara tutarlı şekilde dağıtır"""
     
-    def generate_phone_variants(self, phone):
-        """Telefon numarası varyantları üret"""
-        if not phone:
-            return []
-            
-        variants = set()
-        variants.add(phone)
-        
-        # Sadece rakamlar
-        digits = re.sub(r'\D', '', phone)
-        
-        if digits:
-            variants.add('+' + digits)
-            variants.add(digits)
-            
-            # Türkiye formatları
-            if len(digits) == 10 and digits.startswith('5'):
-                variants.add('+90' + digits)
-            elif len(digits) == 11 and digits.startswith('05'):
-                variants.add('+90' + digits[1:])
-            elif len(digits) == 12 and digits.startswith('90'):
-                variants.add('+' + digits)
-            
-            # Arnavutluk formatları  
-            if len(digits) == 9 and digits.startswith('6'):
-                variants.add('+355' + digits)
-            elif len(digits) == 12 and digits.startswith('355'):
-                variants.add('+' + digits)
+    def __init__(self, sessions):
+        self.sessions = sessions
+    
+    @classmethod
+    def from_config(cls, count=BOT_SESSIONS, profile_root=BOT_PROFILE_ROOT, linked_numbers=BOT_LINKED_NUMBERS):
+        """Ortam ayarlarından N oturum oluştur"""
+        sessions = []
+        for i in range(count):
+            session_id = f"session-{i + 1}"
+            linked_number = linked_numbers[i] if i < len(linked_numbers) else None
+            sessions.append(WhatsAppBot(
+                session_id=session_id,
+                profile_dir=os.path.join(profile_root, session_id),
+                linked_number=linked_number
+            ))
+        return cls(sessions)
+    
+    def route(self, phone):
+        """Telefon için oturum seç - rendezvous hashing, yeniden bağlananlar atlanır"""
+        candidates = [session for session in self.sessions if session.is_available()]
+        if not candidates:
+            return None
         
-        return list(variants)
+        digits = (canonical_phone(phone) or "").lstrip("+")
+        return max(
+            candidates,
+            key=lambda session: hashlib.md5(f"{session.session_id}:{digits}".encode()).digest()
+        )
     
-    def normalize_phone(self, phone):
-        """Telefon numarasını normalize et"""
-        if not phone:
-            return phone
-            
-        # Sadece rakamları al
-        digits = re.sub(r'\D', '', phone)
-        
-        # Farklı formatları normalize et
-        if digits.startswith('90') and len(digits) == 12:
-            return '+' + digits
-        elif digits.startswith('355') and len(digits) == 12:
-            return '+' + digits
-        elif digits.startswith('5') and len(digits) == 10:
-            return '+90' + digits
-        elif digits.startswith('0') and len(digits) == 11:
-            return '+90' + digits[1:]
-        else:
-            return '+' + digits
+    def send(self, phone, tur, message):
+        """Gelen sohbete bağlı olmayan gönderimler için - oturumu router seçer"""
+        session = self.route(phone)
+        if not session:
+            logger.error(f"❌ Kullanılabilir oturum yok: {phone}")
+            return False
+        return session.outbound_queue.put(phone, tur, message)
+    
+    def watchdog(self):
+        """Takılan dinleyicileri bul - Chrome kapatılınca bekleyen çağrı hata verir ve oturum yeniden başlar"""
+        while True:
+            time.sleep(HEALTH_PROBE_INTERVAL)
+            for session in self.sessions:
+                if session.is_stalled():
+                    logger.error(f"🩺 Dinleyici takıldı, Chrome kapatılıyor: {session.session_id}")
+                    session.health["status"] = "stalled"
+                    session.ready = False
+                    try:
+                        if session.driver:
+                            session.driver.quit()
+                    except Exception as e:
+                        logger.warning(f"Driver kapatma hatası [{session.session_id}]: {e}")
+    
+    def any_ready(self):
+        """En az bir oturum hazır mı"""
+        return any(session.is_available() for session in self.sessions)
+    
+    def stats(self):
+        """Tüm oturumların durumu"""
+        return [session.stats() for session in self.sessions]
+    
+    def quit(self):
+        """Tüm Chrome sürücülerini kapat"""
+        for session in self.sessions:
+            if session.driver:
+                try:
+                    session.driver.quit()
+                except Exception as e:
+                    logger.warning(f"Driver kapatma hatası [{session.session_id}]: {e}")
 
-# WhatsApp bot instance
-whatsapp_bot = None
+# WhatsApp oturum havuzu
+session_pool = None
 
-def cleanup_expired_otps():
-    """Süresi dolmuş OTP'leri temizleme"""
-    while True:
-        try:
-            current_time = datetime.now()
-            with otp_lock:
-                expired_keys = []
-                for key, data in otp_pool.items():
-                    if current_time - data["timestamp"] > timedelta(minutes=5):
-                        expired_keys.append(key)
-                
-                for key in expired_keys:
-                    del otp_pool[key]
-                    logger.info(f"🗑️ Süresi dolmuş OTP temizlendi: {key}")
-            
-            time.sleep(60)  # Her dakika kontrol et
-            
-        except Exception as e:
-            logger.error(f"OTP temizlemede hata: {e}")
-            time.sleep(60)
+# Tek batch isteğinde kabul edilen en fazla OTP
+OTP_BATCH_MAX = int(os.environ.get("OTP_BATCH_MAX", "1000"))
+
+# Push modu açık türler (virgülle, örn. "oluşturma,düzenleme") - OTP gelir gelmez gönderilir
+# Kod havuzda kalır; müşteri yine de "kod" yazarsa normal akış (pull) cevaplar
+PUSH_MODE_TURS = {t.strip() for t in os.environ.get("PUSH_MODE_TURS", "").split(",") if t.strip()}
+
+def push_otp(tel, tur, otp):
+    """Push modu açıksa OTP'yi hemen gönderim kuyruğuna al - kuyruğa alındıysa True"""
+    if tur not in PUSH_MODE_TURS:
+        return False
+    
+    if not session_pool:
+        METRIC_OTP_PUSHED.inc("no_session")
+        return False
+    
+    if session_pool.send(tel, tur, OTP_REPLY_TEMPLATE.format(otp=otp)):
+        METRIC_OTP_PUSHED.inc("queued")
+        logger.info(f"📲 OTP PUSH KUYRUĞA ALINDI: {tel} - {tur} - {mask_otp(otp)}")
+        return True
+    
+    METRIC_OTP_PUSHED.inc("not_queued")
+    return False
+
+def validate_otp_payload(data):
+    """OTP kaydını doğrula - ((telefon, tür, otp), None) veya (None, hata mesajı)"""
+    if not isinstance(data, dict):
+        return None, "Geçersiz JSON"
+    
+    # Gerekli alanları kontrol et
+    required_fields = ["tur", "otp", "tel"]
+    for field in required_fields:
+        if field not in data:
+            return None, f"Eksik alan: {field}"
+    
+    tur = data["tur"]
+    otp = data["otp"]
+    tel = data["tel"]
+    
+    # Veri doğrulama
+    if tur not in ["oluşturma", "düzenleme"]:
+        return None, "Geçersiz tür"
+    
+    # Telefon numarası kontrolünü esnetiyoruz
+    if not isinstance(tel, str) or not tel.startswith("+"):
+        return None, "Telefon numarası + ile başlamalı"
+    
+    if not isinstance(otp, str) or not otp.isdigit() or len(otp) != 4:
+        return None, "Geçersiz OTP formatı (4 haneli olmalı)"
+    
+    return (canonical_phone(tel), tur, otp), None
 
 @app.route('/otp', methods=['POST'])
 def receive_otp():
     """Cardg API'den OTP alma endpoint'i"""
+    started = time.perf_counter()
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
         if not data:
             return jsonify({"error": "Geçersiz JSON"}), 400
         
-        # Gerekli alanları kontrol et
-        required_fields = ["tur", "otp", "tel"]
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Eksik alan: {field}"}), 400
-        
-        tur = data["tur"]
-        otp = data["otp"]
-        tel = data["tel"]
-        
-        # Veri doğrulama
-        if tur not in ["oluşturma", "düzenleme"]:
-            return jsonify({"error": "Geçersiz tür"}), 400
-        
-        # Telefon numarası kontrolünü esnetiyoruz
-        if not tel.startswith("+"):
-            return jsonify({"error": "Telefon numarası + ile başlamalı"}), 400
-        
-        if not otp.isdigit() or len(otp) != 4:
-            return jsonify({"error": "Geçersiz OTP formatı (4 haneli olmalı)"}), 400
-        
-        # OTP'yi havuza ekle
-        with otp_lock:
-            key = (tel, tur)
-            otp_pool[key] = {
-                "otp": otp,
-                "timestamp": datetime.now()
-            }
+        entry, error = validate_otp_payload(data)
+        if error:
+            return jsonify({"error": error}), 400
         
-        logger.info(f"📥 OTP KAYDEDİLDİ: {tel} - {tur} - {otp}")
+        # OTP'yi havuza canonical telefonla ekle
+        tel, tur, otp = entry
+        otp_pool.put(tel, tur, otp)
+        
+        logger.info(f"📥 OTP KAYDEDİLDİ: {tel} - {tur} - {mask_otp(otp)}")
+        pushed = push_otp(tel, tur, otp)
+        METRIC_INGEST_SECONDS.observe(time.perf_counter() - started, "otp")
         
         return jsonify({
             "message": "OTP başarıyla kaydedildi",
             "telefon": tel,
             "tur": tur,
+            "push": pushed,
             "timestamp": datetime.now().isoformat()
         }), 200
         
@@ -559,71 +2482,191 @@ def receive_otp():
         logger.error(f"OTP alma hatası: {e}")
         return jsonify({"error": "Sunucu hatası"}), 500
 
+@app.route('/otp/batch', methods=['POST'])
+def receive_otp_batch():
+    """Toplu OTP alma - JSON dizi veya satır satır JSON (NDJSON)"""
+    started = time.perf_counter()
+    try:
+        body = request.get_data(as_text=True).strip()
+        if not body:
+            return jsonify({"error": "Boş istek"}), 400
+        
+        # JSON dizi mi, NDJSON mu?
+        try:
+            if body.startswith("["):
+                items = json.loads(body)
+            else:
+                items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except ValueError:
+            return jsonify({"error": "Geçersiz JSON"}), 400
+        
+        if len(items) > OTP_BATCH_MAX:
+            return jsonify({"error": f"En fazla {OTP_BATCH_MAX} kayıt gönderilebilir"}), 413
+        
+        # Önce hepsini doğrula, sonra tek kilitle ekle
+        results = []
+        valid_entries = []
+        for index, item in enumerate(items):
+            entry, error = validate_otp_payload(item)
+            if error:
+                results.append({"index": index, "status": "error", "error": error})
+            else:
+                valid_entries.append(entry)
+                results.append({"index": index, "status": "ok", "telefon": entry[0], "tur": entry[1]})
+        
+        otp_pool.put_many(valid_entries)
+        
+        # Push modundaki türler hemen gönderilir
+        pushed = sum(1 for tel, tur, otp in valid_entries if push_otp(tel, tur, otp))
+        
+        logger.info(f"📥 TOPLU OTP: {len(valid_entries)}/{len(items)} kaydedildi")
+        METRIC_INGEST_SECONDS.observe(time.perf_counter() - started, "otp_batch")
+        
+        return jsonify({
+            "accepted": len(valid_entries),
+            "rejected": len(items) - len(valid_entries),
+            "pushed": pushed,
+            "results": results,
+            "timestamp": datetime.now().isoformat()
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Toplu OTP alma hatası: {e}")
+        return jsonify({"error": "Sunucu hatası"}), 500
+
 @app.route('/status', methods=['GET'])
 def get_status():
     """Bot durumu kontrolü"""
-    global whatsapp_ready
-    
+    pool_stats = otp_pool.stats()
     return jsonify({
-        "whatsapp_ready": whatsapp_ready,
-        "active_otps": len(otp_pool),
+        "whatsapp_ready": session_pool.any_ready() if session_pool else False,
+        "healthy_sessions": sum(1 for session in session_pool.sessions if session.is_available()) if session_pool else 0,
+        "active_otps": pool_stats["active"],
+        "otp_pool": pool_stats,
+        "push_mode_turs": sorted(PUSH_MODE_TURS),
+        "sessions": session_pool.stats() if session_pool else [],
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrikleri"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/pool', methods=['GET'])
 def get_pool_status():
     """OTP havuzu durumu (debug için)"""
-    with otp_lock:
-        pool_info = {}
-        for key, data in otp_pool.items():
-            phone, tur = key
-            pool_info[f"{phone}_{tur}"] = {
-                "otp": data["otp"][:2] + "**",  # Güvenlik için kısmen gizle
-                "age_minutes": (datetime.now() - data["timestamp"]).total_seconds() / 60
-            }
+    entries = otp_pool.snapshot()
+    pool_info = {}
+    for key, data in entries.items():
+        phone, tur = key
+        pool_info[f"{phone}_{tur}"] = {
+            "otp": mask_otp(data["otp"]),  # Güvenlik için kısmen gizle
+            "age_minutes": (datetime.now() - data["timestamp"]).total_seconds() / 60
+        }
     
     return jsonify({
-        "pool_count": len(otp_pool),
+        "pool_count": len(entries),
         "pool_info": pool_info,
         "timestamp": datetime.now().isoformat()
     })
 
+# HTTP sunucu ayarları
+# HTTP_SERVER: "waitress" (varsayılan, kuruluysa), "threaded" (werkzeug) veya "dev" (Flask geliştirme sunucusu)
+HTTP_SERVER = os.environ.get("HTTP_SERVER", "waitress")
+HTTP_HOST = os.environ.get("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.environ.get("HTTP_PORT", "5000"))
+HTTP_THREADS = int(os.environ.get("HTTP_THREADS", "8"))     # waitress ve werkzeug için worker sayısı (dev hariç)
+HTTP_KEEPALIVE = int(os.environ.get("HTTP_KEEPALIVE", "30"))
+HTTP_BACKLOG = int(os.environ.get("HTTP_BACKLOG", "1024"))  # sadece waitress
+
+def serve_http():
+    """HTTP endpoint'lerini seçilen sunucuyla çalıştır - endpoint'ler tarayıcıya dokunmaz"""
+    if HTTP_SERVER == "dev":
+        logger.warning("⚠️ Flask geliştirme sunucusu kullanılıyor")
+        app.run(host=HTTP_HOST, port=HTTP_PORT, debug=False, threaded=True)
+        return
+    
+    if HTTP_SERVER == "waitress" and waitress_serve:
+        logger.info(f"🌐 waitress: {HTTP_HOST}:{HTTP_PORT} - {HTTP_THREADS} worker, keep-alive {HTTP_KEEPALIVE}s")
+        waitress_serve(
+            app,
+            host=HTTP_HOST,
+            port=HTTP_PORT,
+            threads=HTTP_THREADS,
+            channel_timeout=HTTP_KEEPALIVE,
+            backlog=HTTP_BACKLOG,
+            ident="whatsapp-otp-bot"
+        )
+        return
+    
+    if HTTP_SERVER == "waitress":
+        logger.warning("⚠️ waitress kurulu değil, werkzeug sunucusu kullanılıyor")
+    
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    
+    # HTTP/1.1 ile bağlantılar açık tutulur (keep-alive)
+    class KeepAliveRequestHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+        timeout = HTTP_KEEPALIVE
+    
+    server = make_server(HTTP_HOST, HTTP_PORT, app, request_handler=KeepAliveRequestHandler)
+    
+    # Bağlantılar sabit boyutlu havuzda işlenir - werkzeug threaded=True gibi istek başına sınırsız thread açılmaz
+    # Açık tutulan (keep-alive) her bağlantı kapanana kadar bir worker'ı meşgul eder, fazlası sırada bekler
+    workers = ThreadPoolExecutor(max_workers=HTTP_THREADS, thread_name_prefix="http")
+    
+    def handle_connection(connection, client_address):
+        try:
+            server.finish_request(connection, client_address)
+        except Exception:
+            server.handle_error(connection, client_address)
+        finally:
+            server.shutdown_request(connection)
+    
+    server.process_request = lambda connection, client_address: workers.submit(
+        handle_connection, connection, client_address
+    )
+    logger.info(f"🌐 werkzeug: {HTTP_HOST}:{HTTP_PORT} - {HTTP_THREADS} worker, keep-alive {HTTP_KEEPALIVE}s")
+    server.serve_forever()
+
 def main():
     """Ana fonksiyon"""
-    global whatsapp_bot
+    global session_pool
     
     logger.info("🚀 WhatsApp OTP Bot başlatılıyor...")
     
     try:
-        # WhatsApp bot'u başlat
-        whatsapp_bot = WhatsAppBot()
-        
-        # WhatsApp'a bağlan
-        if not whatsapp_bot.connect_whatsapp():
-            logger.error("❌ WhatsApp bağlantısı kurulamadı!")
-            return
+        # WhatsApp oturumlarını başlat
+        session_pool = SessionPool.from_config()
+        logger.info(f"🧩 {len(session_pool.sessions)} oturum oluşturuldu")
         
         # OTP temizleme thread'ini başlat
-        cleanup_thread = threading.Thread(target=cleanup_expired_otps, daemon=True)
+        cleanup_thread = threading.Thread(target=otp_pool.run_expiry, daemon=True)
         cleanup_thread.start()
         
-        # WhatsApp mesaj dinleme thread'ini başlat
-        listen_thread = threading.Thread(target=whatsapp_bot.listen_messages, daemon=True)
-        listen_thread.start()
+        # Her oturum kendi thread'inde bağlanır ve dinler - HTTP girişi QR beklemesini beklemez
+        for session in session_pool.sessions:
+            session_thread = threading.Thread(target=session.run, daemon=True)
+            session_thread.start()
+        
+        # Takılan oturumları yakalayan gözetmen
+        watchdog_thread = threading.Thread(target=session_pool.watchdog, daemon=True)
+        watchdog_thread.start()
         
         logger.info("✅ Bot başarıyla başlatıldı!")
-        logger.info("🌐 Flask server başlatılıyor...")
+        logger.info("🌐 HTTP server başlatılıyor...")
         
-        # Flask server'ı başlat
-        app.run(host='0.0.0.0', port=5000, debug=False)
+        # HTTP server'ı başlat - Selenium thread'lerinden bağımsız
+        serve_http()
         
     except KeyboardInterrupt:
         logger.info("🛑 Bot kapatılıyor...")
     except Exception as e:
         logger.error(f"❌ Bot başlatma hatası: {e}")
     finally:
-        if whatsapp_bot and whatsapp_bot.driver:
-            whatsapp_bot.driver.quit()
+        if session_pool:
+            session_pool.quit()
 
 if __name__ == "__main__":
     main()